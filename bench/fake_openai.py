@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from aiohttp import web
+from controllers.slot_filling import ALLOWED_VALUES
+
+# Stand-in for the OpenAI chat completions API so benchmarks run offline.
+# Function calls fill the first parameter the state message lists as missing,
+# and finish once the user says "done".
+
+MISSING = re.compile(r"Still missing: ([^.]*)\.")
+
+class FakeOpenAI:
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, chunk_size: int = 12, chunk_delay: float = 0.01, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.requests = 0
+
+    async def _delay(self):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def function_arguments(self, messages: list):
+        user_messages = [message["content"] for message in messages if message["role"] == "user"]
+        finished = bool(user_messages) and "done" in user_messages[-1].lower()
+        missing = []
+        for message in messages:
+            match = MISSING.search(message.get("content") or "") if message["role"] == "system" else None
+            if match:
+                missing = [name.strip() for name in match.group(1).split(",") if name.strip() in ALLOWED_VALUES]
+        updates = []
+        if missing and not finished:
+            updates.append({"parameter": missing[0], "value": ALLOWED_VALUES[missing[0]][0], "valid": True})
+        next_parameter = missing[1] if len(missing) > 1 else None
+        return {
+            "updates": updates,
+            "message": "Thanks, noted." if updates else "All set.",
+            "next_question": f"What should {next_parameter} be?" if next_parameter else "Anything else, or are you done?",
+            "finished": finished,
+        }
+
+    def _completion(self, body: dict):
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(message.get("content") or "") // 4 for message in messages)
+        if body.get("functions"):
+            function = body["functions"][0]["name"]
+            message = {"role": "assistant", "content": None, "function_call": {
+                "name": function, "arguments": json.dumps(self.function_arguments(messages)),
+            }}
+        else:
+            message = {"role": "assistant", "content": "Grow qualified pipeline from this campaign."}
+        content = message.get("content") or message["function_call"]["arguments"]
+        return message, prompt_tokens, len(content) // 4
+
+    async def chat_completions(self, request: web.Request):
+        self.requests += 1
+        body = await request.json()
+        await self._delay()
+        if random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "Injected failure", "type": "server_error"}}, status=500)
+        message, prompt_tokens, completion_tokens = self._completion(body)
+        if not body.get("stream"):
+            return web.json_response({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        function_call = message.get("function_call")
+        text = function_call["arguments"] if function_call else message["content"]
+        for start in range(0, len(text), self.chunk_size):
+            piece = text[start:start + self.chunk_size]
+            if function_call:
+                delta = {"function_call": {"name": function_call["name"], "arguments": piece} if start == 0 else {"arguments": piece}}
+            else:
+                delta = {"content": piece}
+            chunk = {"object": "chat.completion.chunk", "model": body.get("model"), "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(self.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def models(self, request: web.Request):
+        return web.json_response({"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        return app
+
+async def start_fake_openai(fake: FakeOpenAI, host: str = "127.0.0.1", port: int = 8900):
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fake OpenAI server on its own.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeOpenAI(args.latency, args.jitter, error_rate=args.error_rate)
+    web.run_app(fake.app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
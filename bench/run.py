@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+# Drives trigger -> N x continuechat -> process_workflow against the app served
+# by uvicorn on localhost, with the fake OpenAI server and the in-memory Mongo
+# stand-in, so a run needs no network access or credentials. Going through a
+# real socket keeps streamed responses chunked, so the stream TTFB is the time
+# to the first byte on the wire. Run from the repo root:
+#
+#   python -m bench.run --conversations 500 --concurrency 100 --llm-latency 0.8 --compare
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BENCH_WORKFLOW_ID = "bench-workflow"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the workflow chat flow offline.")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=6, help="continuechat calls before the user says they are done")
+    parser.add_argument("--fast-path-ratio", type=float, default=0.7, help="share of answers picked verbatim from the suggested values")
+    parser.add_argument("--stream", action="store_true", help="use /continuechat/stream for chat turns")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--openai-port", type=int, default=8900)
+    parser.add_argument("--app-port", type=int, default=8901)
+    parser.add_argument("--label", default="local")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--compare", nargs="?", const="latest", help="compare with a stored result file (default: the latest one)")
+    parser.add_argument("--no-save", action="store_true")
+    return parser.parse_args()
+
+def configure_environment(args):
+    # Must run before the app is imported: openai and the config modules read
+    # these at import time.
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    os.environ.setdefault("OPENAI_KEY", "bench")
+    os.environ["MONGO_BACKEND"] = "memory"
+    os.environ.setdefault("JOB_POLL_INTERVAL", "0.05")
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint: str, seconds: float, ok: bool = True):
+        if ok:
+            self.samples[endpoint].append(seconds)
+        else:
+            self.errors[endpoint] += 1
+
+    def summary(self, wall_seconds: float):
+        endpoints = {}
+        for endpoint in sorted(set(self.samples) | set(self.errors)):
+            values = self.samples[endpoint]
+            endpoints[endpoint] = {
+                "count": len(values),
+                "errors": self.errors[endpoint],
+                "throughput_rps": len(values) / wall_seconds if wall_seconds else 0.0,
+                "mean_ms": 1000 * sum(values) / len(values) if values else None,
+                "p50_ms": 1000 * percentile(values, 0.50) if values else None,
+                "p95_ms": 1000 * percentile(values, 0.95) if values else None,
+                "p99_ms": 1000 * percentile(values, 0.99) if values else None,
+            }
+        return endpoints
+
+def pick_answer(question: str, collected: dict, fast_path_ratio: float):
+    from controllers.slot_filling import ALLOWED_VALUES, infer_parameter
+    parameter = infer_parameter(question, collected)
+    if parameter and random.random() < fast_path_ratio:
+        collected[parameter] = True
+        return random.choice(ALLOWED_VALUES[parameter])
+    return "whatever you would recommend for us"
+
+async def timed(recorder: Recorder, endpoint: str, call):
+    start = time.perf_counter()
+    try:
+        response = await call()
+    except Exception:
+        recorder.record(endpoint, 0, ok=False)
+        raise
+    recorder.record(endpoint, time.perf_counter() - start, ok=response.status_code < 400)
+    response.raise_for_status()
+    return response
+
+async def stream_turn(client, recorder: Recorder, body: dict):
+    start = time.perf_counter()
+    first_byte = None
+    payload = ""
+    async with client.stream("POST", "/workflowchat/continuechat/stream", json=body) as response:
+        async for text in response.aiter_text():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            payload += text
+    ok = response.status_code < 400 and "event: done" in payload
+    recorder.record("continuechat_stream_ttfb", first_byte or 0, ok=ok)
+    recorder.record("continuechat_stream", time.perf_counter() - start, ok=ok)
+    if not ok:
+        raise RuntimeError(f"stream turn failed: {payload[-200:]}")
+    done = payload.split("event: done\ndata: ", 1)[1].split("\n\n", 1)[0]
+    return json.loads(done)
+
+async def conversation(client, recorder: Recorder, args):
+    response = await timed(recorder, "trigger", lambda: client.post(f"/workflowchat/trigger/{BENCH_WORKFLOW_ID}"))
+    chat = response.json()
+    chat_id, question = chat["workFlowChatId"], chat["question"]
+    collected = {}
+    for turn in range(args.turns + 1):
+        answer = "That's all, I'm done" if turn == args.turns else pick_answer(question, collected, args.fast_path_ratio)
+        body = {"chatId": chat_id, "user_response": answer}
+        if args.stream:
+            result = await stream_turn(client, recorder, body)
+        else:
+            result = (await timed(recorder, "continuechat", lambda: client.post("/workflowchat/continuechat", json=body))).json()
+        question = (result or {}).get("question", "")
+    start = time.perf_counter()
+    job = (await timed(recorder, "process_workflow", lambda: client.post(f"/workflowchat/process_workflow/{chat_id}"))).json()
+    while job["status"] not in ("succeeded", "failed"):
+        await asyncio.sleep(0.02)
+        job = (await client.get(f"/workflowchat/jobs/{job['jobId']}")).json()
+    recorder.record("process_workflow_job", time.perf_counter() - start, ok=job["status"] == "succeeded")
+
+async def start_app_server(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, http="httptools",
+                                           log_level="warning", access_log=False))
+    # Runs the app's startup and shutdown hooks like `python serve.py` does.
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+            raise RuntimeError("app server exited during startup")
+        await asyncio.sleep(0.01)
+    return server, task
+
+async def stop_app_server(server, task):
+    server.should_exit = True
+    await task
+
+async def run(args):
+    import httpx
+    from bench.fake_openai import FakeOpenAI, start_fake_openai
+    from main import app
+    from routes.routes import timed_verify_session
+
+    fake = FakeOpenAI(args.llm_latency, args.llm_jitter, error_rate=args.llm_error_rate)
+    runner = await start_fake_openai(fake, port=args.openai_port)
+    app.dependency_overrides[timed_verify_session] = lambda: None
+    server, server_task = await start_app_server(app, args.app_port)
+    await app.database["workflows"].insert_one({"_id": BENCH_WORKFLOW_ID, "workFlowName": "Create New Campaign"})
+    recorder = Recorder()
+    queue = asyncio.Queue()
+    for index in range(args.conversations):
+        queue.put_nowait(index)
+
+    async def virtual_user(client):
+        while not queue.empty():
+            queue.get_nowait()
+            try:
+                await conversation(client, recorder, args)
+            except Exception as e:
+                recorder.errors["conversation"] += 1
+                print(f"conversation failed: {e!r}", file=sys.stderr)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.app_port}", limits=limits, timeout=120) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(virtual_user(client) for _ in range(args.concurrency)))
+            wall_seconds = time.perf_counter() - start
+    finally:
+        await stop_app_server(server, server_task)
+        await runner.cleanup()
+    return {
+        "label": args.label,
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "git_rev": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "no_save")},
+        "wall_seconds": wall_seconds,
+        "conversations_per_second": (args.conversations - recorder.errors["conversation"]) / wall_seconds,
+        "llm_requests": fake.requests,
+        "endpoints": recorder.summary(wall_seconds),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_result(result: dict):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = result["timestamp"].replace(":", "").replace("-", "").split(".")[0]
+    path = os.path.join(RESULTS_DIR, f"{stamp}_{result['label']}.json")
+    with open(path, "w") as file:
+        json.dump(result, file, indent=2)
+    return path
+
+def load_baseline(reference: str, exclude: str = None):
+    if reference != "latest":
+        with open(reference, "r") as file:
+            return json.load(file)
+    paths = sorted(path for path in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if path != exclude)
+    if not paths:
+        return None
+    with open(paths[-1], "r") as file:
+        return json.load(file)
+
+def format_ms(value):
+    return "-" if value is None else f"{value:9.1f}"
+
+def print_report(result: dict, baseline: dict = None):
+    print(f"{result['label']} @ {result['git_rev']}: {result['config']['conversations']} conversations, "
+          f"concurrency {result['config']['concurrency']}, {result['wall_seconds']:.2f}s wall, "
+          f"{result['conversations_per_second']:.2f} conv/s, {result['llm_requests']} LLM calls")
+    print(f"{'endpoint':28}{'count':>7}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in result["endpoints"].items():
+        print(f"{endpoint:28}{stats['count']:>7}{stats['errors']:>5}{stats['throughput_rps']:>9.1f}"
+              f"{format_ms(stats['p50_ms']):>10}{format_ms(stats['p95_ms']):>10}{format_ms(stats['p99_ms']):>10}")
+    if not baseline:
+        return
+    print(f"\nvs {baseline['label']} @ {baseline['git_rev']} ({baseline['timestamp']}):")
+    for endpoint, stats in result["endpoints"].items():
+        previous = baseline["endpoints"].get(endpoint)
+        if not previous:
+            continue
+        deltas = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            if stats[key] is not None and previous[key]:
+                deltas.append(f"{key} {100 * (stats[key] - previous[key]) / previous[key]:+.1f}%")
+        print(f"  {endpoint:26} " + ", ".join(deltas))
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    configure_environment(args)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = asyncio.run(run(args))
+    path = None if args.no_save else save_result(result)
+    baseline = load_baseline(args.compare, exclude=path) if args.compare else None
+    print_report(result, baseline)
+    if path:
+        print(f"\nsaved {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from config.memory_db import InMemoryClient
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "dripify")
+# "mongo" talks to MONGO_URI; "memory" swaps in the in-process stand-in.
+MONGO_BACKEND = os.getenv("MONGO_BACKEND", "mongo")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+
+def create_mongodb_client():
+    if MONGO_BACKEND == "memory":
+        return InMemoryClient()
+    return AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    )
+
+async def connect_mongodb(app):
+    # motor connects lazily, so this does not wait on the server; ping_mongodb
+    # is what tells whether it can actually be reached.
+    app.mongodb_client = create_mongodb_client()
+    app.database = app.mongodb_client[MONGO_DB_NAME]
+    return f"MongoDB client ready for database {MONGO_DB_NAME} ({MONGO_BACKEND})"
+
+async def ping_mongodb(app):
+    await app.mongodb_client.admin.command("ping")
+    return True
+
+async def close_mongodb(app):
+    client = getattr(app, "mongodb_client", None)
+    if client is not None:
+        client.close()
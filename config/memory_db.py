@@ -0,0 +1,376 @@
+import copy
+import itertools
+from types import SimpleNamespace
+from bson import ObjectId
+
+# In-process stand-in for the subset of the motor API the repositories use.
+# Selected with MONGO_BACKEND=memory for local runs and benchmarks; it keeps
+# no state across restarts and takes no locks beyond the event loop.
+
+_MISSING = object()
+
+def _get_path(document, path: str):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+def _set_path(document, path: str, value):
+    parts = path.split(".")
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+def _unset_path(document, path: str):
+    parts = path.split(".")
+    target = _get_path(document, ".".join(parts[:-1])) if len(parts) > 1 else document
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+
+def _compare(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for operator, operand in condition.items():
+            present = value is not _MISSING
+            current = value if present else None
+            if operator == "$eq" and current != operand:
+                return False
+            if operator == "$ne" and current == operand:
+                return False
+            if operator == "$in" and current not in operand:
+                return False
+            if operator == "$nin" and current in operand:
+                return False
+            if operator == "$exists" and present != bool(operand):
+                return False
+            if operator in ("$gt", "$gte", "$lt", "$lte"):
+                if not present or current is None:
+                    return False
+                try:
+                    if operator == "$gt" and not current > operand:
+                        return False
+                    if operator == "$gte" and not current >= operand:
+                        return False
+                    if operator == "$lt" and not current < operand:
+                        return False
+                    if operator == "$lte" and not current <= operand:
+                        return False
+                except TypeError:
+                    return False
+        return True
+    if value is _MISSING:
+        return condition is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+def matches(document, query: dict) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif not _compare(_get_path(document, key), condition):
+            return False
+    return True
+
+def _project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    slices = {key: value["$slice"] for key, value in projection.items() if isinstance(value, dict)}
+    flags = {key: value for key, value in projection.items() if not isinstance(value, dict)}
+    if any(flags.get(key) for key in flags if key != "_id"):
+        result = {"_id": document["_id"]} if flags.get("_id", 1) else {}
+        for key, flag in flags.items():
+            value = _get_path(document, key)
+            if flag and key != "_id" and value is not _MISSING:
+                _set_path(result, key, copy.deepcopy(value))
+        for key in slices:
+            value = _get_path(document, key)
+            if value is not _MISSING:
+                _set_path(result, key, copy.deepcopy(value))
+    else:
+        result = copy.deepcopy(document)
+        for key, flag in flags.items():
+            if not flag:
+                _unset_path(result, key)
+    for key, size in slices.items():
+        value = _get_path(result, key)
+        if isinstance(value, list):
+            _set_path(result, key, value[size:] if size < 0 else value[:size])
+    return result
+
+def _evaluate(expression, document):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get_path(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, list):
+        return [_evaluate(item, document) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) == 1:
+        operator, operand = next(iter(expression.items()))
+        if operator == "$literal":
+            return copy.deepcopy(operand)
+        if operator.startswith("$"):
+            args = _evaluate(operand, document)
+            if operator == "$concatArrays":
+                return list(itertools.chain.from_iterable(args))
+            if operator == "$slice":
+                array = args[0]
+                if len(args) == 2:
+                    return array[args[1]:] if args[1] < 0 else array[:args[1]]
+                return array[args[1]:args[1] + args[2]]
+            if operator == "$arrayElemAt":
+                array, index = args
+                return array[index] if -len(array) <= index < len(array) else None
+            if operator == "$mergeObjects":
+                merged = {}
+                for item in args:
+                    merged.update(item or {})
+                return merged
+            if operator == "$size":
+                return len(args)
+            if operator == "$add":
+                return sum(args)
+            if operator == "$subtract":
+                return args[0] - args[1]
+            if operator == "$ifNull":
+                return args[0] if args[0] is not None else args[1]
+            if operator == "$gt":
+                return args[0] > args[1]
+            if operator == "$cond":
+                return args[1] if args[0] else args[2]
+            raise NotImplementedError(f"Unsupported expression operator {operator}")
+    return {key: _evaluate(value, document) for key, value in expression.items()}
+
+def _apply_update(document, update, inserting: bool):
+    if isinstance(update, list):
+        for stage in update:
+            for operator, fields in stage.items():
+                if operator not in ("$set", "$addFields"):
+                    raise NotImplementedError(f"Unsupported pipeline stage {operator}")
+                values = {path: _evaluate(expression, document) for path, expression in fields.items()}
+                for path, value in values.items():
+                    _set_path(document, path, value)
+        return
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set":
+                _set_path(document, path, copy.deepcopy(value))
+            elif operator == "$setOnInsert":
+                if inserting:
+                    _set_path(document, path, copy.deepcopy(value))
+            elif operator == "$unset":
+                _unset_path(document, path)
+            elif operator == "$inc":
+                current = _get_path(document, path)
+                _set_path(document, path, (0 if current is _MISSING else current) + value)
+            elif operator == "$push":
+                current = _get_path(document, path)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                _set_path(document, path, (current if isinstance(current, list) else []) + copy.deepcopy(items))
+            elif operator == "$addToSet":
+                current = _get_path(document, path)
+                current = list(current) if isinstance(current, list) else []
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                _set_path(document, path, current + [copy.deepcopy(item) for item in items if item not in current])
+            else:
+                raise NotImplementedError(f"Unsupported update operator {operator}")
+
+def _sort_key(spec):
+    def key(document):
+        values = []
+        for field, direction in spec:
+            value = _get_path(document, field)
+            values.append((value is not _MISSING and value is not None, value if value is not _MISSING else None))
+        return values
+    return key
+
+class InMemoryCursor:
+    def __init__(self, documents, projection=None):
+        self._documents = documents
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _results(self):
+        documents = list(self._documents)
+        for field, direction in reversed(self._sort):
+            documents.sort(key=_sort_key([(field, direction)]), reverse=direction < 0)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(document, self._projection) for document in documents]
+
+    def __aiter__(self):
+        self._iterator = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results if length is None else results[:length]
+
+class InMemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._documents = {}
+
+    def _find(self, query):
+        return [document for document in self._documents.values() if matches(document, query)]
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def insert_one(self, document):
+        document = copy.deepcopy(document)
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            raise KeyError(f"Duplicate key {document['_id']}")
+        self._documents[document["_id"]] = document
+        return SimpleNamespace(inserted_id=document["_id"], acknowledged=True)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        results = await cursor.limit(1).to_list()
+        return results[0] if results else None
+
+    def find(self, query=None, projection=None, **kwargs):
+        return InMemoryCursor(self._find(query), projection)
+
+    async def count_documents(self, query):
+        return len(self._find(query))
+
+    def _upsert_document(self, query):
+        document = {key: copy.deepcopy(value) for key, value in query.items()
+                    if not key.startswith("$") and not isinstance(value, dict)}
+        document.setdefault("_id", ObjectId())
+        return document
+
+    async def update_one(self, query, update, upsert=False):
+        found = self._find(query)
+        if found:
+            before = copy.deepcopy(found[0])
+            _apply_update(found[0], update, inserting=False)
+            return SimpleNamespace(matched_count=1, modified_count=int(before != found[0]), upserted_id=None)
+        if upsert:
+            document = self._upsert_document(query)
+            _apply_update(document, update, inserting=True)
+            self._documents[document["_id"]] = document
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=document["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update):
+        found = self._find(query)
+        for document in found:
+            _apply_update(document, update, inserting=False)
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found), upserted_id=None)
+
+    async def find_one_and_update(self, query, update, sort=None, projection=None, upsert=False, return_document=False):
+        found = self._find(query)
+        if sort:
+            found.sort(key=_sort_key(sort))
+        if not found:
+            if not upsert:
+                return None
+            document = self._upsert_document(query)
+            _apply_update(document, update, inserting=True)
+            self._documents[document["_id"]] = document
+            return _project(document, projection) if return_document else None
+        document = found[0]
+        before = _project(document, projection)
+        _apply_update(document, update, inserting=False)
+        return _project(document, projection) if return_document else before
+
+    async def replace_one(self, query, replacement, upsert=False):
+        found = self._find(query)
+        if found:
+            replacement = copy.deepcopy(replacement)
+            replacement["_id"] = found[0]["_id"]
+            self._documents[replacement["_id"]] = replacement
+            return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            document = {**self._upsert_document(query), **copy.deepcopy(replacement)}
+            self._documents[document["_id"]] = document
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=document["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def delete_one(self, query):
+        found = self._find(query)
+        if found:
+            del self._documents[found[0]["_id"]]
+        return SimpleNamespace(deleted_count=len(found[:1]))
+
+    async def delete_many(self, query):
+        found = self._find(query)
+        for document in found:
+            del self._documents[document["_id"]]
+        return SimpleNamespace(deleted_count=len(found))
+
+    async def create_index(self, keys, **kwargs):
+        return keys if isinstance(keys, str) else "_".join(f"{field}_{direction}" for field, direction in keys)
+
+class InMemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name: str):
+        if name not in self._collections:
+            self._collections[name] = InMemoryCollection(name)
+        return self._collections[name]
+
+    async def command(self, name, *args, **kwargs):
+        return {"ok": 1.0}
+
+class InMemoryClient:
+    def __init__(self):
+        self._databases = {}
+        self.admin = InMemoryDatabase("admin")
+
+    def __getitem__(self, name: str):
+        if name not in self._databases:
+            self._databases[name] = InMemoryDatabase(name)
+        return self._databases[name]
+
+    def close(self):
+        pass
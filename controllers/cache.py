@@ -0,0 +1,226 @@
+import copy
+import hashlib
+import json
+import os
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from pymongo.errors import PyMongoError
+from controllers.slot_filling import ALLOWED_VALUES, FREE_TEXT_PARAMETERS, match_value, normalize
+from controllers.metrics import register_collector
+
+WORKFLOW_CACHE_MAX_ENTRIES = int(os.getenv("WORKFLOW_CACHE_MAX_ENTRIES", "1024"))
+WORKFLOW_CACHE_MAX_BYTES = int(os.getenv("WORKFLOW_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+WORKFLOW_CACHE_TTL = float(os.getenv("WORKFLOW_CACHE_TTL", "86400"))
+WORKFLOW_CACHE_COLLECTION = "workflowcache"
+
+FOLLOW_UP_CACHE_ENABLED = os.getenv("FOLLOW_UP_CACHE_ENABLED", "true").lower() == "true"
+FOLLOW_UP_CACHE_SHARED = os.getenv("FOLLOW_UP_CACHE_SHARED", "true").lower() == "true"
+FOLLOW_UP_CACHE_MAX_ENTRIES = int(os.getenv("FOLLOW_UP_CACHE_MAX_ENTRIES", "4096"))
+FOLLOW_UP_CACHE_MAX_BYTES = int(os.getenv("FOLLOW_UP_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+FOLLOW_UP_CACHE_TTL = float(os.getenv("FOLLOW_UP_CACHE_TTL", "3600"))
+FOLLOW_UP_CACHE_COLLECTION = "followupcache"
+# Turns at or past this index share one bucket in the per-turn hit rates.
+FOLLOW_UP_CACHE_MAX_TURN_LABEL = 15
+
+# Everything a cached filled workflow depends on: the template placeholders
+# plus AudienceSegment, which only the LLM end-goal prompt reads.
+CAMPAIGN_FIELDS = ["CampaignType", "AudienceSegment", "CampaignDuration", "ContentType", "CallToAction", "PersonalizationLevel", "A/BTestingElements", "SuccessMetrics", "ListName", "SavedSearch"]
+
+class TTLCache:
+    """In-process LRU with per-entry TTL, bounded by entry count and approximate size in bytes."""
+
+    def __init__(self, max_entries: int, ttl: float, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = Counter()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._drop(key)
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def set(self, key, value):
+        if key in self._entries:
+            self._drop(key)
+        size = len(json.dumps(value, default=str))
+        self._entries[key] = (time.monotonic() + self.ttl, value, size)
+        self.bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def snapshot(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "evictions": self.stats["evictions"],
+            "expirations": self.stats["expirations"],
+        }
+
+def _canonical_field(parameter: str, value):
+    if value is None:
+        return None
+    text = str(value)
+    if parameter in FREE_TEXT_PARAMETERS:
+        # Rendered verbatim, so only surrounding whitespace is insignificant.
+        return text.strip()
+    if parameter in ALLOWED_VALUES:
+        match = match_value(parameter, text)
+        if match:
+            return match[0]
+    return normalize(text)
+
+def campaign_cache_key(campaign_info: dict) -> str:
+    canonical = {field: _canonical_field(field, campaign_info.get(field)) for field in CAMPAIGN_FIELDS}
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class WorkflowCache:
+    """Local LRU tier in front of a Mongo collection shared by every worker."""
+
+    def __init__(self, local: TTLCache, value_field: str = "workflow"):
+        self.local = local
+        self.value_field = value_field
+        self.stats = Counter()
+
+    async def get(self, key: str, collection=None):
+        value = self.local.get(key)
+        if value is not None:
+            self.stats["local_hits"] += 1
+            return copy.deepcopy(value)
+        if collection is not None:
+            try:
+                document = await collection.find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}})
+            except PyMongoError:
+                self.stats["shared_errors"] += 1
+                document = None
+            if document:
+                self.stats["shared_hits"] += 1
+                self.local.set(key, document[self.value_field])
+                return copy.deepcopy(document[self.value_field])
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: dict, collection=None):
+        self.local.set(key, copy.deepcopy(value))
+        if collection is None:
+            return
+        document = {
+            "_id": key,
+            self.value_field: value,
+            "expiresAt": datetime.utcnow() + timedelta(seconds=self.local.ttl),
+        }
+        try:
+            await collection.replace_one({"_id": key}, document, upsert=True)
+        except PyMongoError:
+            self.stats["shared_errors"] += 1
+
+    def snapshot(self):
+        lookups = self.stats["local_hits"] + self.stats["shared_hits"] + self.stats["misses"]
+        hits = self.stats["local_hits"] + self.stats["shared_hits"]
+        return {
+            "local": self.local.snapshot(),
+            "local_hits": self.stats["local_hits"],
+            "shared_hits": self.stats["shared_hits"],
+            "misses": self.stats["misses"],
+            "shared_errors": self.stats["shared_errors"],
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+workflow_cache = WorkflowCache(TTLCache(WORKFLOW_CACHE_MAX_ENTRIES, WORKFLOW_CACHE_TTL, WORKFLOW_CACHE_MAX_BYTES))
+
+def _workflow_cache_metrics():
+    snapshot = workflow_cache.snapshot()
+    yield "workflow_cache_lookups_total", "counter", "Filled workflow cache lookups by outcome.", {
+        (("result", "local_hit"),): snapshot["local_hits"],
+        (("result", "shared_hit"),): snapshot["shared_hits"],
+        (("result", "miss"),): snapshot["misses"],
+    }
+    yield "workflow_cache_evictions_total", "counter", "Entries evicted from the local workflow cache tier.", {(): snapshot["local"]["evictions"]}
+    yield "workflow_cache_entries", "gauge", "Entries held in the local workflow cache tier.", {(): snapshot["local"]["entries"]}
+
+register_collector(_workflow_cache_metrics)
+
+def follow_up_cache_key(collected_info: dict, context: list) -> str:
+    # The state system message serialises collected_info in answer order, so the
+    # key is built from the sorted parameters and the visible turns instead.
+    turns = [
+        [message["role"], normalize(message["content"]) if message["role"] == "user" else " ".join(message["content"].split())]
+        for message in context if message["role"] != "system"
+    ]
+    payload = json.dumps({"state": collected_info, "turns": turns}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _turn_label(turn_index: int) -> str:
+    if turn_index >= FOLLOW_UP_CACHE_MAX_TURN_LABEL:
+        return f"{FOLLOW_UP_CACHE_MAX_TURN_LABEL}+"
+    return str(turn_index)
+
+class FollowUpCache(WorkflowCache):
+    """Memoized follow-up completions, with hit rates kept per turn index."""
+
+    def __init__(self, local: TTLCache):
+        super().__init__(local, value_field="result")
+        self.turn_stats = Counter()
+
+    async def get(self, key: str, collection=None, turn_index: int = 0):
+        value = await super().get(key, collection)
+        self.turn_stats[(_turn_label(turn_index), "miss" if value is None else "hit")] += 1
+        return value
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot["enabled"] = FOLLOW_UP_CACHE_ENABLED
+        turns = {}
+        for (turn, outcome), count in self.turn_stats.items():
+            turns.setdefault(turn, {"hits": 0, "misses": 0})["hits" if outcome == "hit" else "misses"] = count
+        for counts in turns.values():
+            counts["hit_rate"] = counts["hits"] / (counts["hits"] + counts["misses"])
+        snapshot["turns"] = dict(sorted(turns.items(), key=lambda item: int(item[0].rstrip("+"))))
+        return snapshot
+
+follow_up_cache = FollowUpCache(TTLCache(FOLLOW_UP_CACHE_MAX_ENTRIES, FOLLOW_UP_CACHE_TTL, FOLLOW_UP_CACHE_MAX_BYTES))
+
+def _follow_up_cache_metrics():
+    yield "follow_up_cache_lookups_total", "counter", "Follow-up response cache lookups by turn index and outcome.", {
+        (("turn", turn), ("result", outcome)): count for (turn, outcome), count in follow_up_cache.turn_stats.items()
+    }
+    yield "follow_up_cache_evictions_total", "counter", "Entries evicted from the local follow-up cache tier.", {(): follow_up_cache.local.stats["evictions"]}
+    yield "follow_up_cache_entries", "gauge", "Entries held in the local follow-up cache tier.", {(): len(follow_up_cache.local)}
+
+register_collector(_follow_up_cache_metrics)
+
+async def ensure_workflow_cache_indexes(database):
+    # Mongo drops shared entries on its own once expiresAt passes.
+    await database[WORKFLOW_CACHE_COLLECTION].create_index("expiresAt", expireAfterSeconds=0)
+    await database[FOLLOW_UP_CACHE_COLLECTION].create_index("expiresAt", expireAfterSeconds=0)
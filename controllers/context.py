@@ -0,0 +1,42 @@
+import json
+import os
+from controllers.slot_filling import ALLOWED_VALUES
+
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "4"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+
+def estimate_tokens(messages) -> int:
+    # ~4 characters per token plus per-message framing; close enough for budgeting.
+    return sum(len(message["content"]) // 4 + 4 for message in messages)
+
+def missing_parameters(collected_info: dict):
+    return [parameter for parameter in ALLOWED_VALUES if parameter not in collected_info]
+
+def state_message(collected_info: dict):
+    missing = missing_parameters(collected_info)
+    return {
+        "role": "system",
+        "content": (
+            f"Campaign parameters collected so far: {json.dumps(collected_info, separators=(',', ':'))}. "
+            f"Still missing: {', '.join(missing) if missing else 'none'}."
+        ),
+    }
+
+def build_context(history_messages: list, collected_info: dict, user_response: str,
+                  max_turns: int = CONTEXT_MAX_TURNS, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    # Send the compact state plus the last few answered turns instead of the whole
+    # transcript, so the prompt stays flat however long the conversation runs.
+    state = [state_message(collected_info)]
+    pending = [
+        {"role": "assistant", "content": history_messages[-1]["question"]},
+        {"role": "user", "content": user_response},
+    ]
+    answered = [message for message in history_messages[:-1] if message.get("response") is not None]
+    turns = [
+        [{"role": "assistant", "content": message["question"]}, {"role": "user", "content": message["response"]}]
+        for message in answered[-max_turns:] if max_turns > 0
+    ]
+    fixed_tokens = estimate_tokens(state + pending)
+    while turns and fixed_tokens + estimate_tokens([m for turn in turns for m in turn]) > token_budget:
+        turns.pop(0)
+    return state + [message for turn in turns for message in turn] + pending
@@ -1,122 +1,161 @@
-from fastapi import Request, HTTPException, status
+from fastapi import Request, HTTPException, status, WebSocket, WebSocketDisconnect
 from fastapi.encoders import jsonable_encoder
 from models.model import WorkflowChat, WorkflowChatMessage
 from supertokens_python.recipe.session import SessionContainer
+from controllers.llm import chat_completion, stream_chat_completion
+from controllers.resilience import CircuitOpenError
+from controllers.streaming import PartialJSONFields, sse_event, ws_frame
+from controllers.slot_filling import MULTI_VALUE_PARAMETERS, PARAMETER_NAMES, fast_fill, validate_updates
+from controllers.cache import (
+    FOLLOW_UP_CACHE_COLLECTION, FOLLOW_UP_CACHE_ENABLED, FOLLOW_UP_CACHE_SHARED, WORKFLOW_CACHE_COLLECTION,
+    campaign_cache_key, follow_up_cache, follow_up_cache_key, workflow_cache,
+)
+from controllers.templates import render_workflow, template_values
+from controllers.context import CONTEXT_MAX_TURNS, build_context, estimate_tokens
+from repositories.repositories import get_workflow_repository, get_workflow_chat_repository
+from controllers.metrics import WEBSOCKETS_OPEN, stage_timer
+from controllers.jobs import JOB_BATCH_MAX_SIZE, JOB_COLLECTION, SUCCEEDED, JobQueue
+from storage.artifacts import CAMPAIGN_INFO, FILLED_WORKFLOW, artifact_id, create_artifact_store, get_artifact_store
+from datetime import datetime, timezone
+import asyncio
+import base64
 import openai
 import json
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
-openai.api_key =  os.getenv("OPENAI_KEY")
 
-def get_workflow_collection(request: Request):
-    return request.app.database["workflows"]
+# Render the workflow purely from the template unless an LLM-written endGoal is wanted.
+WORKFLOW_LLM_END_GOAL = os.getenv("WORKFLOW_LLM_END_GOAL", "false").lower() == "true"
+# Chat sockets that send nothing for this long are closed to free the slot.
+WEBSOCKET_IDLE_TIMEOUT = float(os.getenv("WEBSOCKET_IDLE_TIMEOUT", "300"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_MAX_BATCH_SIZE = int(os.getenv("EXPORT_MAX_BATCH_SIZE", "5000"))
 
-def get_workflow_chat_collection(request: Request):
-    return request.app.database["workflowchats"]
+def get_workflow_cache_collection(database):
+    return database[WORKFLOW_CACHE_COLLECTION]
 
 def generate_initial_prompt():
     return ("Hello! I'm excited to help you launch your Dripify campaign. To get started, could you tell me what type of campaign you want to create? For example, Welcome Series, Product Launch, Customer Re-engagement, etc.")
 
-def generate_follow_up_question(context):
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """
-                   You are a dripify campaign launch assistant for Dripify(a linkedin automation tool).
+def follow_up_completion_args(context):
+    return dict(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": """
+               You are a dripify campaign launch assistant for Dripify(a linkedin automation tool).
   Your tasks are to:
 
-        1. **Collect User Requirements:** Start by asking clear and friendly questions to gather details about the campaign launch. Ensure that each question is specific to one parameter at a time.
-        2. **Clarify and Confirm:** If any answers are ambiguous or incomplete, ask follow-up questions to clarify their needs and make sure you have all the necessary information.
-        3. **Map Responses:** Use the reference mapping provided below to convert user responses into the appropriate Dripify categories. Validate their inputs and populate the JSON object accordingly.
-        4. **Handle Invalid Responses:** When encountering invalid answers, offer examples from the allowed values list. Re-ask the question in a helpful manner until you receive a valid response.
-        5. **Allow Modifications:** Users should be able to modify any previously provided parameters. If they request changes, update the existing data as needed.
-        6. **Track and Complete:** Keep track of all information gathered. If any details are missing, ask for those specific pieces to complete the campaign setup according to Dripify’s criteria.
-        7. **Skipping Questions:** Users can skip questions by leaving them blank or explicitly indicating they want to skip. In such cases, map the skipped parameter to a placeholder value or handle it accordingly.
-        8. **Determine Completion:** Monitor user responses for cues indicating they want to finish. If they use phrases like "that's enough" or "I'm done," set 'finished' to true and end the process.
+    1. **Collect User Requirements:** Start by asking clear and friendly questions to gather details about the campaign launch. Ensure that each question is specific to one parameter at a time.
+    2. **Clarify and Confirm:** If any answers are ambiguous or incomplete, ask follow-up questions to clarify their needs and make sure you have all the necessary information.
+    3. **Map Responses:** Use the reference mapping provided below to convert user responses into the appropriate Dripify categories. Validate their inputs and populate the JSON object accordingly.
+    4. **Handle Invalid Responses:** When encountering invalid answers, offer examples from the allowed values list. Re-ask the question in a helpful manner until you receive a valid response.
+    5. **Allow Modifications:** Users should be able to modify any previously provided parameters. If they request changes, update the existing data as needed.
+    6. **Track and Complete:** Keep track of all information gathered. If any details are missing, ask for those specific pieces to complete the campaign setup according to Dripify’s criteria.
+    7. **Skipping Questions:** Users can skip questions by leaving them blank or explicitly indicating they want to skip. In such cases, map the skipped parameter to a placeholder value or handle it accordingly.
+    8. **Determine Completion:** Monitor user responses for cues indicating they want to finish. If they use phrases like "that's enough" or "I'm done," set 'finished' to true and end the process.
    
 
   Reference mapping for allowed values:
-    - CampaignType: Welcome Series, Product Launch, Customer Re-engagement, Abandoned Cart, Seasonal Promotion, Loyalty Program, Newsletter, Event Invitation
-    - AudienceSegment: New Subscribers, Active Customers, Inactive Customers, High-value Customers, First-time Buyers, Repeat Customers, Abandoned Cart Users
-    - EmailFrequency: Daily, Every Other Day, Twice a Week, Weekly, Bi-weekly, Monthly
-    - CampaignDuration: 3 days, 1 week, 2 weeks, 1 month, 3 months, 6 months, Ongoing
-    - ContentType: Promotional, Educational, Testimonials, Product Updates, Company News, User-generated Content, Behind-the-scenes
-    - CallToAction: Shop Now, Learn More, Book a Demo, Subscribe, Claim Offer, Join Waitlist, RSVP
-    - PersonalizationLevel: Basic (Name), Intermediate (Browsing History), Advanced (Purchase History + Preferences)
-    - A/BTestingElements: Subject Lines, Email Content, Send Times, CTAs, Images, Personalization Level
-    - SuccessMetrics: Open Rate, Click-through Rate, Conversion Rate, Revenue Generated, List Growth Rate, Unsubscribe Rate
+- CampaignType: Welcome Series, Product Launch, Customer Re-engagement, Abandoned Cart, Seasonal Promotion, Loyalty Program, Newsletter, Event Invitation
+- AudienceSegment: New Subscribers, Active Customers, Inactive Customers, High-value Customers, First-time Buyers, Repeat Customers, Abandoned Cart Users
+- EmailFrequency: Daily, Every Other Day, Twice a Week, Weekly, Bi-weekly, Monthly
+- CampaignDuration: 3 days, 1 week, 2 weeks, 1 month, 3 months, 6 months, Ongoing
+- ContentType: Promotional, Educational, Testimonials, Product Updates, Company News, User-generated Content, Behind-the-scenes
+- CallToAction: Shop Now, Learn More, Book a Demo, Subscribe, Claim Offer, Join Waitlist, RSVP
+- PersonalizationLevel: Basic (Name), Intermediate (Browsing History), Advanced (Purchase History + Preferences)
+- A/BTestingElements: Subject Lines, Email Content, Send Times, CTAs, Images, Personalization Level
+- SuccessMetrics: Open Rate, Click-through Rate, Conversion Rate, Revenue Generated, List Growth Rate, Unsubscribe Rate
 
  Example Mapping:
-    - For **CampaignType**: If the user responds with "welcome emails for new customers", map to "Welcome Series".
-    - For **AudienceSegment**: If the user says "people who have bought before", map to "Repeat Customers".
-    - For **EmailFrequency**: If the user mentions "every other day", map to "Every Other Day".
-    - For **CampaignDuration**: If the user specifies "about a month", map to "1 month".
-    - For **ContentType**: If the user indicates "educational content", map to "Educational".
-    - For **CallToAction**: If the user says "get more info", map to "Learn More".
-    - For **PersonalizationLevel**: If the user mentions "using their browsing history", map to "Intermediate (Browsing History)".
-    - For **A/BTestingElements**: If the user refers to "testing different email subjects", map to "Subject Lines".
-    - For **SuccessMetrics**: If the user says "how many people open the emails", map to "Open Rate".
-    - For **EndGoal**: If the user mentions "increase sales of our new product", map to "Boost sales of new product launch".
-    - For **ListName**: If the user says "new product interested customers", map to "New Product Interest List".
-    - For **SavedSearch**: If the user provides "LinkedIn search for tech professionals in California", map to the appropriate LinkedIn search URL or identifier.
+- For **CampaignType**: If the user responds with "welcome emails for new customers", map to "Welcome Series".
+- For **AudienceSegment**: If the user says "people who have bought before", map to "Repeat Customers".
+- For **EmailFrequency**: If the user mentions "every other day", map to "Every Other Day".
+- For **CampaignDuration**: If the user specifies "about a month", map to "1 month".
+- For **ContentType**: If the user indicates "educational content", map to "Educational".
+- For **CallToAction**: If the user says "get more info", map to "Learn More".
+- For **PersonalizationLevel**: If the user mentions "using their browsing history", map to "Intermediate (Browsing History)".
+- For **A/BTestingElements**: If the user refers to "testing different email subjects", map to "Subject Lines".
+- For **SuccessMetrics**: If the user says "how many people open the emails", map to "Open Rate".
+- For **EndGoal**: If the user mentions "increase sales of our new product", map to "Boost sales of new product launch".
+- For **ListName**: If the user says "new product interested customers", map to "New Product Interest List".
+- For **SavedSearch**: If the user provides "LinkedIn search for tech professionals in California", map to the appropriate LinkedIn search URL or identifier.
 
   When a response is invalid, provide the user with specific examples from the mapping list and ask them to provide a valid response. Confirm all parameters with the user and request any additional details as needed. Maintain a smooth conversation flow and ensure the user can update their inputs if necessary. End the process when the user indicates they are finished.
-                    """
-                },
-                {
-                    "role": "system",
-                    "content": """
-                    The user may provide responses that need to be mapped to allowed values. Your response should:
-                    1. Validate user input against the allowed values specified in the reference mapping.
-                    2. Provide examples of valid responses if the input is invalid, using the reference mapping as a guide.
-                    3. Confirm the parameters with the user and request any additional details if needed to ensure accurate Campaign Launch criteria.
-                    4. Handle requests to change parameters by updating the existing data based on user feedback.
-                    5. Maintain the conversation flow by asking the next relevant question from the list of required parameters.
-                    6. Determine if the user wants to finish the process based on their responses. If the user indicates they are done (e.g., "that's enough", "finish", "no more details"), set 'finished' to true and conclude the interaction.
-                    """
-                },
-                *context
-            ],
-            functions=[
-                {
-                    "name": "update_campaign_info",
-                    "description": "Update or add campaign launch parameters based on user input.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "parameter": {"type": "string", "description": "The parameter to update or add"},
-                            "value": {"type": "string", "description": "The mapped value for the parameter"},
-                            "valid": {"type": "boolean", "description": "Whether the input is valid"},
-                            "message": {"type": "string", "description": "Message to display to the user"},
-                            "next_question": {"type": "string", "description": "Next question to ask the user"},
-                            "finished": {"type": "boolean", "description": "Whether the user wants to finish the process"}
+                """
+            },
+            {
+                "role": "system",
+                "content": """
+                The user may provide responses that need to be mapped to allowed values. Your response should:
+                1. Validate user input against the allowed values specified in the reference mapping.
+                2. Provide examples of valid responses if the input is invalid, using the reference mapping as a guide.
+                3. Confirm the parameters with the user and request any additional details if needed to ensure accurate Campaign Launch criteria.
+                4. Handle requests to change parameters by updating the existing data based on user feedback.
+                5. Maintain the conversation flow by asking the next relevant question from the list of required parameters.
+                6. Determine if the user wants to finish the process based on their responses. If the user indicates they are done (e.g., "that's enough", "finish", "no more details"), set 'finished' to true and conclude the interaction.
+                7. When a single reply provides or changes several parameters, record each of them as its own entry in 'updates'.
+                """
+            },
+            *context
+        ],
+        functions=[
+            {
+                "name": "update_campaign_info",
+                "description": "Update or add campaign launch parameters based on user input.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "updates": {
+                            "type": "array",
+                            "description": "Every parameter the user provided or changed in this reply",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "parameter": {"type": "string", "enum": PARAMETER_NAMES, "description": "The parameter to update or add"},
+                                    "value": {"type": "string", "description": f"The mapped value for the parameter; a comma-separated list for {' and '.join(MULTI_VALUE_PARAMETERS)}"},
+                                    "valid": {"type": "boolean", "description": "Whether the input is valid"}
+                                },
+                                "required": ["parameter", "value", "valid"]
+                            }
                         },
-                        "required": ["parameter", "value", "valid", "message", "next_question", "finished"]
-                    }
+                        "message": {"type": "string", "description": "Message to display to the user"},
+                        "next_question": {"type": "string", "description": "Next question to ask the user"},
+                        "finished": {"type": "boolean", "description": "Whether the user wants to finish the process"}
+                    },
+                    "required": ["updates", "message", "next_question", "finished"]
                 }
-            ],
-            function_call={"name": "update_campaign_info"}
-        )
+            }
+        ],
+        function_call={"name": "update_campaign_info"}
+    )
+
+def estimate_prompt_tokens(context):
+    return estimate_tokens(follow_up_completion_args(context)["messages"])
+
+async def generate_follow_up_question(context):
+    # Returns the parsed function call and the prompt tokens the API billed.
+    try:
+        response = await chat_completion(call_site="follow_up", **follow_up_completion_args(context))
         if hasattr(response.choices[0].message, 'function_call'):
             result = json.loads(response.choices[0].message['function_call']['arguments'])
-            return result
+            return result, (response.get("usage") or {}).get("prompt_tokens")
         else:
             raise HTTPException(status_code=400, detail="No function call found in the response")
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"OpenAI API unavailable: {str(e)}")
+    except openai.error.Timeout as e:
+        raise HTTPException(status_code=504, detail=f"OpenAI API timed out: {str(e)}")
     except openai.error.OpenAIError as e:
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
     
-def save_workflow_chat_to_json(chat_id: str, data: dict):
-    filename = f"campaign_launch_requirements_{chat_id}.json"
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
-    return filename
+async def save_workflow_chat_to_store(request: Request, chat_id: str, data: dict):
+    return await get_artifact_store(request).put(CAMPAIGN_INFO, chat_id, data)
 
-def trigger_workflow_chat(request: Request, workflowId: str):
+async def trigger_workflow_chat(request: Request, workflowId: str):
     initial_question = generate_initial_prompt()
     workflow_chat = WorkflowChat(
         workflowid=workflowId,
@@ -124,247 +163,396 @@ def trigger_workflow_chat(request: Request, workflowId: str):
         collected_info={}
     )
     workflow_chat_data = jsonable_encoder(workflow_chat)
-    new_workflow_chat = get_workflow_chat_collection(request).insert_one(workflow_chat_data)
-    if new_workflow_chat.inserted_id:
+    inserted_id = await get_workflow_chat_repository(request).create(workflow_chat_data)
+    if inserted_id:
         return {
-            "workFlowChatId": str(new_workflow_chat.inserted_id),
+            "workFlowChatId": str(inserted_id),
             "question": initial_question,
         }
     else:
         raise HTTPException(status_code=401, detail="Error while creating workflow chat")
     
-def continue_workflow_chat(request: Request, chatId: str, user_response: str):
-    workflow_chat = get_workflow_chat_collection(request).find_one({"_id": chatId})
+async def load_workflow_chat(request: Request, chatId: str):
+    workflow_chat = await get_workflow_chat_repository(request).load_turn_state(chatId, CONTEXT_MAX_TURNS)
     if not workflow_chat:
         raise HTTPException(status_code=404, detail="Workflow chat not found")
-    workFlowId = workflow_chat["workflowid"]
+    return workflow_chat
+
+def prepare_workflow_chat_turn(workflow_chat: dict, user_response: str):
     history_messages = workflow_chat["messages"]
-    collected_info = workflow_chat.get("collected_info", {})
-    last_message = history_messages[-1]
-    last_message["response"] = user_response
-    history_messages[-1] = last_message
-    context = [{"role": "assistant", "content": message["question"]} for message in history_messages]
-    context.append({"role": "user", "content": user_response})
-    result = generate_follow_up_question(context)
-    if result['valid']:
-        collected_info[result['parameter']] = result['value']
-        new_message = WorkflowChatMessage(question=result['next_question'])
-        history_messages.append(jsonable_encoder(new_message))
-        update_data = {
-            "messages": history_messages,
-            "collected_info": collected_info
-        }
-        if result['finished']:
-            update_data["is_completed"] = True
-            json_filename = save_workflow_chat_to_json(chatId, collected_info)
-            update_data["json_filename"] = json_filename
-        update_workflow_chat = get_workflow_chat_collection(request).update_one(
-            {"_id": chatId},
-            {"$set": update_data}
-        )
-        if update_workflow_chat.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Workflow chat not found")
-        response = {
-            "workFlowChatId": chatId,
-            "question": result['next_question'],
-        }
-        if result['finished']:
-            # response["message"] = "Workflow completed. JSON file saved."
-            # response["json_filename"] = json_filename
-            workFlow = get_workflow_collection(request).find_one({"_id": workFlowId})
-            return workFlow
-        return response
-    else:
+    context = build_context(history_messages, workflow_chat.get("collected_info", {}), user_response)
+    history_messages[-1]["response"] = user_response
+    return context
+
+async def load_workflow_chat_turn(request: Request, chatId: str, user_response: str):
+    workflow_chat = await load_workflow_chat(request, chatId)
+    return workflow_chat, prepare_workflow_chat_turn(workflow_chat, user_response)
+
+async def save_workflow_chat_turn(request: Request, chatId: str, workflow_chat: dict, result: dict, prompt_tokens: int = None):
+    updates = validate_updates(result.get('updates', []))
+    if not updates and not result['finished']:
         raise HTTPException(status_code=400, detail=result['message'])
-    
+    workFlowId = workflow_chat["workflowid"]
+    user_response = workflow_chat["messages"][-1]["response"]
+    collected_info = {**workflow_chat.get("collected_info", {}), **updates}
+    new_message = jsonable_encoder(WorkflowChatMessage(question=result['next_question'], prompt_tokens=prompt_tokens))
+    completion_fields = {}
+    if result['finished']:
+        completion_fields["is_completed"] = True
+        completion_fields["completedAt"] = datetime.utcnow()
+        completion_fields["campaign_info_artifact"] = artifact_id(CAMPAIGN_INFO, chatId)
+    saved = await get_workflow_chat_repository(request).append_turn(
+        chatId,
+        workflow_chat.get("version", 0),
+        user_response,
+        new_message,
+        updates,
+        completion_fields
+    )
+    if not saved:
+        raise HTTPException(status_code=409, detail="Workflow chat was updated by another request, please retry")
+    # Keep the loaded state in step with what was written, so a caller holding
+    # on to it (e.g. a WebSocket bound to the chat) can run the next turn as is.
+    workflow_chat["messages"] = (workflow_chat["messages"] + [new_message])[-(CONTEXT_MAX_TURNS + 1):]
+    workflow_chat["collected_info"] = collected_info
+    workflow_chat["version"] = (workflow_chat.get("version") or 0) + 1
+    workflow_chat.update(completion_fields)
+    if result['finished']:
+        await save_workflow_chat_to_store(request, chatId, collected_info)
+    response = {
+        "workFlowChatId": chatId,
+        "question": result['next_question'],
+    }
+    if result['finished']:
+        # response["message"] = "Workflow completed. Campaign info saved."
+        workFlow = await get_workflow_repository(request).get(workFlowId)
+        return workFlow
+    return response
 
+def local_follow_up(workflow_chat: dict, user_response: str):
+    last_question = workflow_chat["messages"][-1]["question"]
+    with stage_timer("slot_fill"):
+        return fast_fill(last_question, user_response, workflow_chat.get("collected_info", {}))
 
-       
-def read_campaign_info(chat_id: str):
-    filename = f"campaign_launch_requirements_{chat_id}.json"
-    if not os.path.exists(filename):
-        raise HTTPException(status_code=404, detail="Campaign info JSON file not found")
-    
-    with open(filename, 'r') as file:
-        campaign_info = json.load(file)
-    
+def get_follow_up_cache_collection(request: Request):
+    return request.app.database[FOLLOW_UP_CACHE_COLLECTION] if FOLLOW_UP_CACHE_SHARED else None
+
+async def cached_follow_up(request: Request, workflow_chat: dict, context: list, bypass_cache: bool = False):
+    if bypass_cache or not FOLLOW_UP_CACHE_ENABLED:
+        return None, None
+    cache_key = follow_up_cache_key(workflow_chat.get("collected_info", {}), context)
+    # The chat version counts the turns answered so far.
+    with stage_timer("follow_up_cache"):
+        result = await follow_up_cache.get(cache_key, get_follow_up_cache_collection(request), workflow_chat.get("version") or 0)
+    return cache_key, result
+
+async def remember_follow_up(request: Request, cache_key: str, result: dict):
+    # Replies that save_workflow_chat_turn would reject are not worth replaying.
+    if cache_key is None or not (validate_updates(result.get("updates", [])) or result.get("finished")):
+        return
+    await follow_up_cache.set(cache_key, result, get_follow_up_cache_collection(request))
+
+async def continue_workflow_chat(request: Request, chatId: str, user_response: str, bypass_cache: bool = False):
+    workflow_chat, context = await load_workflow_chat_turn(request, chatId, user_response)
+    result = local_follow_up(workflow_chat, user_response)
+    prompt_tokens = None
+    cache_key = None
+    if result is None:
+        cache_key, result = await cached_follow_up(request, workflow_chat, context, bypass_cache)
+    if result is None:
+        result, prompt_tokens = await generate_follow_up_question(context)
+        if prompt_tokens is None:
+            prompt_tokens = estimate_prompt_tokens(context)
+        await remember_follow_up(request, cache_key, result)
+    return await save_workflow_chat_turn(request, chatId, workflow_chat, result, prompt_tokens)
+
+async def stream_follow_up_question(context):
+    parser = PartialJSONFields(["message", "next_question"])
+    try:
+        async for chunk in stream_chat_completion(call_site="follow_up", **follow_up_completion_args(context)):
+            function_call = chunk["choices"][0]["delta"].get("function_call")
+            if function_call and function_call.get("arguments"):
+                for field, text in parser.feed(function_call["arguments"]):
+                    yield field, text
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"OpenAI API unavailable: {str(e)}")
+    except openai.error.Timeout as e:
+        raise HTTPException(status_code=504, detail=f"OpenAI API timed out: {str(e)}")
+    except openai.error.OpenAIError as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+    if not parser.buffer:
+        raise HTTPException(status_code=400, detail="No function call found in the response")
+    try:
+        yield "result", parser.result()
+    except ValueError:
+        raise HTTPException(status_code=500, detail="Invalid function call arguments in the response")
+
+async def workflow_chat_events(request: Request, chatId: str, workflow_chat: dict, context: list, user_response: str,
+                               bypass_cache: bool = False):
+    try:
+        result = local_follow_up(workflow_chat, user_response)
+        prompt_tokens = None
+        if result is None:
+            cache_key, result = await cached_follow_up(request, workflow_chat, context, bypass_cache)
+        if result:
+            yield "message", {"delta": result["message"]}
+            yield "next_question", {"delta": result["next_question"]}
+        else:
+            # Streamed completions carry no usage block, so the size is estimated.
+            prompt_tokens = estimate_prompt_tokens(context)
+            async for field, payload in stream_follow_up_question(context):
+                if field == "result":
+                    result = payload
+                else:
+                    yield field, {"delta": payload}
+            await remember_follow_up(request, cache_key, result)
+        response = await save_workflow_chat_turn(request, chatId, workflow_chat, result, prompt_tokens)
+        yield "done", response
+    except HTTPException as e:
+        # Headers are already sent once streaming starts, so failures are
+        # reported in-band instead of through the status code.
+        yield "error", {"status_code": e.status_code, "detail": e.detail}
+
+async def stream_workflow_chat(request: Request, chatId: str, workflow_chat: dict, context: list, user_response: str,
+                               bypass_cache: bool = False):
+    async for event, data in workflow_chat_events(request, chatId, workflow_chat, context, user_response, bypass_cache):
+        yield sse_event(event, data)
+
+async def serve_workflow_chat_socket(websocket: WebSocket, chatId: str):
+    # The chat is loaded once per connection; save_workflow_chat_turn keeps the
+    # in-memory copy current, so later turns go straight to the model.
+    WEBSOCKETS_OPEN.inc()
+    try:
+        workflow_chat = await load_workflow_chat(websocket, chatId)
+        await websocket.send_text(ws_frame("ready", {
+            "workFlowChatId": chatId,
+            "question": workflow_chat["messages"][-1]["question"],
+            "collected_info": workflow_chat.get("collected_info", {}),
+        }))
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), WEBSOCKET_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await websocket.close(code=status.WS_1000_NORMAL_CLOSURE)
+                return
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+            try:
+                # Binary frames carry no "text" and are rejected like malformed JSON.
+                frame = json.loads(message["text"]) if message.get("text") is not None else None
+            except ValueError:
+                frame = None
+            if frame is None:
+                await websocket.send_text(ws_frame("error", {"status_code": 400, "detail": "Frames must be JSON objects"}))
+                continue
+            user_response = frame.get("user_response") if isinstance(frame, dict) else None
+            if not isinstance(user_response, str):
+                await websocket.send_text(ws_frame("error", {"status_code": 422, "detail": "user_response is required"}))
+                continue
+            context = prepare_workflow_chat_turn(workflow_chat, user_response)
+            events = workflow_chat_events(websocket, chatId, workflow_chat, context, user_response, bool(frame.get("bypass_cache")))
+            async for event, data in events:
+                await websocket.send_text(ws_frame(event, data))
+                if event == "done":
+                    await websocket.send_text(ws_frame("collected_info", workflow_chat.get("collected_info", {})))
+                elif event == "error" and data["status_code"] == 409:
+                    # Another client moved the chat on; pick up its state for the next turn.
+                    workflow_chat = await load_workflow_chat(websocket, chatId)
+    except HTTPException as e:
+        await websocket.send_text(ws_frame("error", {"status_code": e.status_code, "detail": e.detail}))
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        WEBSOCKETS_OPEN.dec()
+
+async def read_campaign_info(database, chat_id: str):
+    campaign_info = await create_artifact_store(database).get(CAMPAIGN_INFO, chat_id)
+    if campaign_info is None:
+        raise HTTPException(status_code=404, detail="Campaign info not found")
     return campaign_info
 
-def create_filled_workflow(campaign_info):
+async def generate_end_goal(campaign_info, default_end_goal):
     message = f"""
-    You are a Dripify campaign launch expert. Your task is to fill out a complete workflow object based on the given campaign information. The workflow object should include all necessary details for launching a campaign in Dripify, including specific actions to perform, their descriptions, and relevant values.
+    You are a Dripify campaign launch expert. Write a one-sentence end goal for a LinkedIn campaign with the details below. Reply with the sentence only.
 
-    Campaign information:
     Campaign Type: {campaign_info.get('CampaignType', 'N/A')}
-    Campaign Duration: {campaign_info.get('CampaignDuration', 'N/A')}
+    Audience Segment: {campaign_info.get('AudienceSegment', 'N/A')}
     Content Type: {campaign_info.get('ContentType', 'N/A')}
     Call To Action: {campaign_info.get('CallToAction', 'N/A')}
-    Personalization Level: {campaign_info.get('PersonalizationLevel', 'N/A')}
-    A/B Testing Elements: {campaign_info.get('A/BTestingElements', 'N/A')}
     Success Metrics: {campaign_info.get('SuccessMetrics', 'N/A')}
-
-    Please fill out the following workflow object template with appropriate values based on the campaign information:
-
-    {{
-      "workFlowName": "Create New Campaign",
-      "endGoal": "Boost engagement with a {{CampaignType}} campaign",
-      "variables": [
-        {{"CampaignType": "{{CampaignType}}"}},
-        {{"CampaignDuration": "{{CampaignDuration}}"}},
-        {{"ContentType": "{{ContentType}}"}},
-        {{"CallToAction": "{{CallToAction}}"}},
-        {{"PersonalizationLevel": "{{PersonalizationLevel}}"}},
-        {{"A/BTestingElements": "{{A/BTestingElements}}"}},
-        {{"SuccessMetrics": "{{SuccessMetrics}}"}}
-      ],
-      "workFlowServiceName": "Dripify",
-      "createdAt": "{{current_utc_time}}",
-      "updatedAt": "{{current_utc_time}}",
-      "actionsToPerform": [
-        {{
-          "_id": "f27deb92-5b96-49cd-9c4e-5253308fdd46",
-          "actionTitle": "Click on 'Campaigns'",
-          "description": "Click on 'Campaigns'",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "click",
-            "value": "{{CampaignType}}"
-          }},
-          "elemPath": "//*[@id='campaigns-link']",
-          "eleClass": "aside__nav-link, js-ripple",
-          "eleId": "campaigns-link",
-          "actionType": "user"
-        }},
-        {{
-          "_id": "d77e43e9-b0e0-4ed7-8d79-86ed71317138",
-          "actionTitle": "Click on 'New Campaign'",
-          "description": "Click on 'New Campaign'",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "click",
-            "value": ""
-          }},
-          "elemPath": "/html/body/div[1]/div[1]/main/div[1]/div[1]/span/a/span",
-          "eleClass": "",
-          "eleId": "",
-          "actionType": "user"
-        }},
-        {{
-          "_id": "21cc0553-928c-49ef-a91e-e29669bd04e8",
-          "actionTitle": "Click on 'Add Leads'",
-          "description": "Click on 'Add Leads'",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "click",
-            "value": ""
-          }},
-          "elemPath": "/html/body/div[1]/div[1]/main/div[1]/div/div[2]/div/section/div[2]/button",
-          "eleClass": "btn, btn--base",
-          "eleId": "",
-          "actionType": "user"
-        }},
-        {{
-          "_id": "77896e4e-8af8-4567-9533-d1df007ebe1e",
-          "actionTitle": "Click to fill list name",
-          "description": "Click to fill list name",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "click",
-            "value": "Boost engagement with a {{CampaignType}} campaign"
-          }},
-          "elemPath": "//*[@id='leadsPackName']",
-          "eleClass": "field__input",
-          "eleId": "leadsPackName",
-          "actionType": "user"
-        }},
-        {{
-          "_id": "89ec2bc0-7cc1-467a-b908-74bcd3cca858",
-          "actionTitle": "Fill list name",
-          "description": "Fill list name",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "type",
-            "value": "Boost engagement with a {{CampaignType}} campaign"
-          }},
-          "elemPath": "//*[@id='leadsPackName']",
-          "eleClass": "field__input",
-          "eleId": "leadsPackName",
-          "actionType": "user"
-        }},
-        {{
-          "_id": "181dddca-141e-4cb1-b196-68bb10211eaf",
-          "actionTitle": "Click to fill your saved search.",
-          "description": "Click to fill your saved search.",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "click",
-            "value": ""
-          }},
-          "elemPath": "//*[@id='LinkedInSearch']",
-          "eleClass": "field__input",
-          "eleId": "LinkedInSearch",
-          "actionType": "user"
-        }},
-        {{
-          "_id": "f381b70a-02ee-4ceb-bd1e-bdb0ae7bdad9",
-          "actionTitle": "Fill your saved search.",
-          "description": "Fill your saved search.",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "fill",
-            "value": "{{CampaignType}}-saved-search-url"
-          }},
-          "elemPath": "//*[@id='LinkedInSearch']",
-          "eleClass": "field__input",
-          "eleId": "LinkedInSearch",
-          "actionType": "user"
-        }},
-        {{
-          "_id": "a5b1c70a-02ee-4ceb-bd1e-bdb0ae7bdad9",
-          "actionTitle": "Click on 'Create a list'",
-          "description": "Click on 'Create a list'",
-          "toolUrl": "http://example.com",
-          "action": {{
-            "type": "click",
-            "value": ""
-          }},
-          "elemPath": "//*[@id='main']/section/section/div[3]/button[2]",
-          "eleClass": "btn btn--primary btn--xlarge btn--addProspect",
-          "eleId": "CreateAList",
-          "actionType": "user"
-        }}
-      ]
-    }}
-
-    Please fill in all placeholders ({{placeholder}}) with appropriate values based on the campaign information provided. Ensure that the output is a valid JSON object.
     """
-
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
+        response = await chat_completion(
+            call_site="filled_workflow",
+            model="gpt-4o-mini",
             messages=[
                 {"role": "user", "content": message}
             ],
             temperature=0.7,
+            max_tokens=60,
         )
+        return response['choices'][0]['message']['content'].strip().strip('"') or default_end_goal
+    except openai.error.OpenAIError:
+        # The template already carries a usable end goal, so the LLM step is best effort.
+        return default_end_goal
 
-        filled_workflow = json.loads(response['choices'][0]['message']['content'])
-        
-        # Ensure createdAt and updatedAt are set to the current time
-        current_time = datetime.utcnow().isoformat() + "Z"
-        filled_workflow['createdAt'] = current_time
-        filled_workflow['updatedAt'] = current_time
+async def generate_filled_workflow(campaign_info):
+    default_end_goal = template_values(campaign_info)["endGoal"]
+    end_goal = await generate_end_goal(campaign_info, default_end_goal)
+    return render_workflow(campaign_info, overrides={"endGoal": end_goal})
 
-        return filled_workflow
-    except openai.error.OpenAIError as e:
-        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+async def create_filled_workflow(campaign_info, cache_collection=None):
+    if campaign_info.get("EndGoal"):
+        with stage_timer("template_render"):
+            filled_workflow = render_workflow(campaign_info, overrides={"endGoal": campaign_info["EndGoal"]})
+    elif not WORKFLOW_LLM_END_GOAL:
+        with stage_timer("template_render"):
+            filled_workflow = render_workflow(campaign_info)
+    else:
+        cache_key = campaign_cache_key(campaign_info)
+        filled_workflow = await workflow_cache.get(cache_key, cache_collection)
+        if filled_workflow is None:
+            filled_workflow = await generate_filled_workflow(campaign_info)
+            await workflow_cache.set(cache_key, filled_workflow, cache_collection)
 
-def process_and_save_filled_workflow(chat_id: str):
-    campaign_info = read_campaign_info(chat_id)
-    filled_workflow = create_filled_workflow(campaign_info)
+    # Ensure createdAt and updatedAt are set to the current time
+    current_time = datetime.utcnow().isoformat() + "Z"
+    filled_workflow['createdAt'] = current_time
+    filled_workflow['updatedAt'] = current_time
+
+    return filled_workflow
+
+async def process_and_save_filled_workflow(database, chat_id: str):
+    campaign_info = await read_campaign_info(database, chat_id)
+    filled_workflow = await create_filled_workflow(campaign_info, get_workflow_cache_collection(database))
+    await save_filled_workflow(database, chat_id, filled_workflow)
+    return filled_workflow
     
-def save_filled_workflow(chat_id: str, filled_workflow: dict):
-    filename = f"filled_workflow_{chat_id}.json"
-    with open(filename, 'w') as file:
-        json.dump(filled_workflow, file, indent=2)
-    return filename
+async def save_filled_workflow(database, chat_id: str, filled_workflow: dict):
+    return await create_artifact_store(database).put(FILLED_WORKFLOW, chat_id, filled_workflow)
+
+async def read_filled_workflow(database, chat_id: str):
+    return await create_artifact_store(database).get(FILLED_WORKFLOW, chat_id)
+
+def encode_export_cursor(chat_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": chat_id}).encode()).decode().rstrip("=")
+
+def decode_export_cursor(cursor: str):
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))["after"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid export cursor")
+
+def _export_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat() + "Z"
+    return str(value)
+
+def _utc_naive(value: datetime):
+    # completedAt is stored as naive UTC, the way datetime.utcnow() returns it.
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def export_batch_size(batch_size: int = None):
+    return max(1, min(batch_size or EXPORT_BATCH_SIZE, EXPORT_MAX_BATCH_SIZE))
+
+async def _export_lines(request: Request, batch: list, include_workflows: bool):
+    chat_ids = [str(chat["_id"]) for chat in batch]
+    workflows = await get_artifact_store(request).get_many(FILLED_WORKFLOW, chat_ids) if include_workflows else {}
+    lines = []
+    for chat_id, chat in zip(chat_ids, batch):
+        record = {
+            "chat_id": chat_id,
+            "workflowid": chat.get("workflowid"),
+            "completedAt": chat.get("completedAt"),
+            "collected_info": chat.get("collected_info", {}),
+        }
+        if "messages" in chat:
+            record["messages"] = chat["messages"]
+        if include_workflows:
+            record["filled_workflow"] = workflows.get(chat_id)
+        # Every record carries the cursor that resumes right after it.
+        record["cursor"] = encode_export_cursor(chat_id)
+        lines.append(json.dumps(record, default=_export_json, separators=(",", ":")) + "\n")
+    return "".join(lines)
+
+async def export_completed_chats(request: Request, after_id: str = None, workflowid: str = None, since: datetime = None,
+                                 until: datetime = None, limit: int = 0, batch_size: int = None,
+                                 include_workflows: bool = True, include_messages: bool = False):
+    # Streams NDJSON one server-side batch at a time, so memory stays flat
+    # however many chats match. The last line reports where to resume.
+    size = export_batch_size(batch_size)
+    cursor = get_workflow_chat_repository(request).find_completed(
+        after_id=after_id, workflowid=workflowid, since=_utc_naive(since), until=_utc_naive(until),
+        include_messages=include_messages, batch_size=size, limit=limit or 0,
+    )
+    count = 0
+    last_id = after_id
+    batch = []
+    async for chat in cursor:
+        batch.append(chat)
+        if len(batch) >= size:
+            with stage_timer("export.batch"):
+                yield await _export_lines(request, batch, include_workflows)
+            count += len(batch)
+            last_id = str(batch[-1]["_id"])
+            batch = []
+    if batch:
+        with stage_timer("export.batch"):
+            yield await _export_lines(request, batch, include_workflows)
+        count += len(batch)
+        last_id = str(batch[-1]["_id"])
+    more = bool(limit) and count >= limit
+    yield json.dumps({"end": True, "count": count, "next_cursor": encode_export_cursor(last_id) if more else None}) + "\n"
+
+PROCESS_WORKFLOW_JOB = "process_workflow"
+
+def create_job_queue(database):
+    async def process_workflow_job(job):
+        await process_and_save_filled_workflow(database, job["chat_id"])
+        return {"artifact": artifact_id(FILLED_WORKFLOW, job["chat_id"])}
+    return JobQueue(database[JOB_COLLECTION], process_workflow_job)
+
+def job_status(job: dict):
+    return {
+        "jobId": job["_id"],
+        "chatId": job["chat_id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+        "createdAt": job["createdAt"],
+        "updatedAt": job["updatedAt"],
+    }
+
+async def enqueue_process_workflow(request: Request, chat_id: str):
+    job = await request.app.job_queue.enqueue(PROCESS_WORKFLOW_JOB, chat_id)
+    return job_status(job)
+
+async def enqueue_process_workflow_batch(request: Request, chat_ids: list):
+    if not chat_ids or len(chat_ids) > JOB_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"Provide between 1 and {JOB_BATCH_MAX_SIZE} chat ids")
+    batch_id, jobs = await request.app.job_queue.enqueue_batch(PROCESS_WORKFLOW_JOB, chat_ids)
+    return {"batchId": batch_id, "jobs": [job_status(job) for job in jobs]}
+
+async def get_process_workflow_job(request: Request, job_id: str):
+    job = await request.app.job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    response = job_status(job)
+    if job["status"] == SUCCEEDED:
+        response["filled_workflow"] = await read_filled_workflow(request.app.database, job["chat_id"])
+    return response
+
+async def get_process_workflow_batch(request: Request, batch_id: str):
+    summary, jobs = await request.app.job_queue.batch_summary(batch_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {
+        "batchId": batch_id,
+        "summary": summary,
+        "jobs": [{"jobId": job["_id"], "chatId": job["chat_id"], "status": job["status"], "error": job.get("error")} for job in jobs],
+    }
@@ -0,0 +1,38 @@
+import asyncio
+import os
+import time
+from pymongo.errors import PyMongoError
+from config.db import ping_mongodb
+from controllers.llm import ping_llm
+
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+# Every balancer probes every few seconds; a recent answer is reused so the
+# probes do not turn into steady load on Mongo and the OpenAI API.
+HEALTH_CHECK_CACHE_SECONDS = float(os.getenv("HEALTH_CHECK_CACHE_SECONDS", "5"))
+# With "false" an unreachable LLM is reported but does not take the worker out
+# of rotation; the slot-fill and cached paths keep serving without it.
+READINESS_REQUIRE_LLM = os.getenv("READINESS_REQUIRE_LLM", "true").lower() == "true"
+
+_results = {}
+
+async def _cached_check(name: str, check):
+    cached = _results.get(name)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    start = time.perf_counter()
+    try:
+        result = {"ok": bool(await asyncio.wait_for(check(), HEALTH_CHECK_TIMEOUT))}
+    except (asyncio.TimeoutError, PyMongoError) as e:
+        result = {"ok": False, "error": type(e).__name__}
+    result["ms"] = round((time.perf_counter() - start) * 1000, 3)
+    _results[name] = (time.monotonic() + HEALTH_CHECK_CACHE_SECONDS, result)
+    return result
+
+async def readiness(app):
+    mongo, llm = await asyncio.gather(
+        _cached_check("mongo", lambda: ping_mongodb(app)),
+        _cached_check("llm", lambda: ping_llm(HEALTH_CHECK_TIMEOUT)),
+    )
+    checks = {"startup": {"ok": getattr(app, "ready", False)}, "mongo": mongo, "llm": llm}
+    required = ["startup", "mongo"] + (["llm"] if READINESS_REQUIRE_LLM else [])
+    return all(checks[name]["ok"] for name in required), checks
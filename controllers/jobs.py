@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+from controllers.metrics import JOB_RETRIES, stage_timer
+
+JOB_COLLECTION = "workflowjobs"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# A running job whose worker died is handed out again once its lease runs out.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_BATCH_MAX_SIZE = int(os.getenv("JOB_BATCH_MAX_SIZE", "500"))
+# Longest pause a worker takes after repeated queue errors (e.g. Mongo unreachable).
+JOB_ERROR_BACKOFF_MAX = float(os.getenv("JOB_ERROR_BACKOFF_MAX", "30"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+logger = logging.getLogger("dripify.jobs")
+
+class JobQueue:
+    """Mongo-backed job queue drained by a bounded pool of in-process workers."""
+
+    def __init__(self, collection, handler, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.collection = collection
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("status", ASCENDING), ("run_after", ASCENDING)])
+        await self.collection.create_index([("chat_id", ASCENDING)])
+        await self.collection.create_index([("batch_ids", ASCENDING)])
+
+    def _new_job(self, kind: str, chat_id: str, batch_id: str = None):
+        now = datetime.utcnow()
+        return {
+            "_id": str(uuid.uuid4()),
+            "kind": kind,
+            "chat_id": chat_id,
+            # A job can belong to several batches when they ask for the same chat.
+            "batch_ids": [batch_id] if batch_id else [],
+            "status": QUEUED,
+            "attempts": 0,
+            "run_after": now,
+            "lease_expires": None,
+            "result": None,
+            "error": None,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+
+    async def enqueue(self, kind: str, chat_id: str, batch_id: str = None):
+        # Asking twice for the same chat while a job is pending returns that job,
+        # now also counted as a member of the new batch.
+        query = {"kind": kind, "chat_id": chat_id, "status": {"$in": [QUEUED, RUNNING]}}
+        if batch_id:
+            pending = await self.collection.find_one_and_update(
+                query, {"$addToSet": {"batch_ids": batch_id}}, return_document=ReturnDocument.AFTER)
+        else:
+            pending = await self.collection.find_one(query)
+        if pending:
+            return pending
+        job = self._new_job(kind, chat_id, batch_id)
+        await self.collection.insert_one(job)
+        self._wakeup.set()
+        return job
+
+    async def enqueue_batch(self, kind: str, chat_ids: list):
+        batch_id = str(uuid.uuid4())
+        jobs = [await self.enqueue(kind, chat_id, batch_id) for chat_id in dict.fromkeys(chat_ids)]
+        return batch_id, jobs
+
+    async def get(self, job_id: str):
+        return await self.collection.find_one({"_id": job_id})
+
+    async def batch_summary(self, batch_id: str):
+        summary = {status: 0 for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
+        jobs = []
+        async for job in self.collection.find({"batch_ids": batch_id}, {"chat_id": 1, "status": 1, "error": 1}):
+            summary[job["status"]] += 1
+            jobs.append(job)
+        return summary, jobs
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "run_after": {"$lte": now}},
+                {"status": RUNNING, "lease_expires": {"$lt": now}},
+            ]},
+            {
+                "$set": {"status": RUNNING, "lease_expires": now + timedelta(seconds=JOB_LEASE_SECONDS), "updatedAt": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_after", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _finish(self, job, update: dict):
+        update["updatedAt"] = datetime.utcnow()
+        update["lease_expires"] = None
+        await self.collection.update_one({"_id": job["_id"], "status": RUNNING}, {"$set": update})
+
+    async def _release(self, job):
+        # Hands an interrupted job straight back to the queue instead of leaving
+        # it to wait out its lease; the interruption does not count as an attempt.
+        now = datetime.utcnow()
+        await self.collection.update_one(
+            {"_id": job["_id"], "status": RUNNING},
+            {"$set": {"status": QUEUED, "run_after": now, "lease_expires": None, "updatedAt": now}, "$inc": {"attempts": -1}},
+        )
+
+    async def _run(self, job):
+        try:
+            with stage_timer(f"job.{job['kind']}"):
+                result = await self.handler(job)
+        except asyncio.CancelledError:
+            try:
+                await asyncio.shield(self._release(job))
+            except Exception:
+                logger.exception("Could not requeue job %s; it runs again once its lease expires", job["_id"])
+            raise
+        except Exception as e:
+            status_code = getattr(e, "status_code", 500)
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            # Client errors such as a missing chat will not fix themselves on retry.
+            if status_code < 500 or job["attempts"] >= self.max_attempts:
+                await self._finish(job, {"status": FAILED, "error": error})
+            else:
+                JOB_RETRIES.inc(kind=job["kind"])
+                delay = JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1) * random.uniform(0.5, 1.5)
+                await self._finish(job, {
+                    "status": QUEUED,
+                    "error": error,
+                    "run_after": datetime.utcnow() + timedelta(seconds=delay),
+                })
+            return
+        await self._finish(job, {"status": SUCCEEDED, "result": result, "error": None})
+
+    async def _worker(self):
+        errors = 0
+        while True:
+            try:
+                job = await self._claim()
+                if job is not None:
+                    await self._run(job)
+            except Exception:
+                # A failed claim or status write leaves the job to be retried
+                # once its lease runs out; the worker itself keeps going.
+                errors += 1
+                logger.exception("Job worker error (%d in a row)", errors)
+                await asyncio.sleep(min(JOB_ERROR_BACKOFF_MAX, JOB_POLL_INTERVAL * 2 ** (errors - 1)) * random.uniform(0.5, 1.5))
+                continue
+            errors = 0
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from typing import Optional
+import aiohttp
+import openai
+from dotenv import load_dotenv
+from controllers.context import estimate_tokens
+from controllers.metrics import LLM_ERRORS, LLM_IN_FLIGHT, LLM_TOKENS, STAGE_SECONDS, stage_timer
+from controllers.resilience import resilient_call, resilient_stream
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_KEY")
+
+# Upper bound on LLM calls in flight per worker process; callers beyond it wait
+# for a slot instead of opening yet another upstream connection.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "100"))
+LLM_KEEPALIVE_TIMEOUT = float(os.getenv("LLM_KEEPALIVE_TIMEOUT", "30"))
+
+_session: Optional[aiohttp.ClientSession] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+def _new_session():
+    connector = aiohttp.TCPConnector(
+        limit=LLM_POOL_SIZE,
+        keepalive_timeout=LLM_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = _new_session()
+    return _session
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+async def start_llm_client():
+    _get_session()
+    _get_semaphore()
+
+async def close_llm_client():
+    global _session, _semaphore
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _semaphore = None
+
+async def ping_llm(timeout: float) -> bool:
+    # Lists models rather than asking for a completion, so probes cost no tokens.
+    try:
+        async with _get_session().get(
+            f"{openai.api_base}/models",
+            headers={"Authorization": f"Bearer {openai.api_key}"},
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as response:
+            return response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+async def _chat_completion_attempt(call_site: str, **kwargs):
+    model = kwargs.get("model", "")
+    async with _get_semaphore():
+        # openai keeps the shared session in a ContextVar, which does not carry
+        # over from the startup hook into request tasks, so bind it per call.
+        openai.aiosession.set(_get_session())
+        LLM_IN_FLIGHT.inc(call_site=call_site)
+        try:
+            with stage_timer(f"llm.{call_site}"):
+                response = await openai.ChatCompletion.acreate(**kwargs)
+        except openai.error.OpenAIError as e:
+            LLM_ERRORS.inc(model=model, call_site=call_site, error=type(e).__name__)
+            raise
+        finally:
+            LLM_IN_FLIGHT.dec(call_site=call_site)
+    usage = response.get("usage") or {}
+    LLM_TOKENS.inc(usage.get("prompt_tokens", 0), model=model, kind="prompt")
+    LLM_TOKENS.inc(usage.get("completion_tokens", 0), model=model, kind="completion")
+    return response
+
+async def _stream_chat_completion_attempt(call_site: str, **kwargs):
+    model = kwargs.get("model", "")
+    async with _get_semaphore():
+        openai.aiosession.set(_get_session())
+        LLM_IN_FLIGHT.inc(call_site=call_site)
+        start = time.perf_counter()
+        completion_chunks = 0
+        try:
+            chunks = await openai.ChatCompletion.acreate(stream=True, **kwargs)
+            async for chunk in chunks:
+                if completion_chunks == 0:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage=f"llm.{call_site}.first_chunk")
+                completion_chunks += 1
+                yield chunk
+        except openai.error.OpenAIError as e:
+            LLM_ERRORS.inc(model=model, call_site=call_site, error=type(e).__name__)
+            raise
+        finally:
+            LLM_IN_FLIGHT.dec(call_site=call_site)
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=f"llm.{call_site}")
+    # Streams carry no usage block; each delta is roughly one token.
+    LLM_TOKENS.inc(estimate_tokens(kwargs.get("messages", [])), model=model, kind="prompt")
+    LLM_TOKENS.inc(completion_chunks, model=model, kind="completion")
+
+async def chat_completion(call_site: str = "default", **kwargs):
+    model = kwargs.pop("model")
+    return await resilient_call(
+        call_site, model, lambda attempt_model: _chat_completion_attempt(call_site, model=attempt_model, **kwargs)
+    )
+
+async def stream_chat_completion(call_site: str = "default", **kwargs):
+    model = kwargs.pop("model")
+    chunks = resilient_stream(
+        call_site, model, lambda attempt_model: _stream_chat_completion_attempt(call_site, model=attempt_model, **kwargs)
+    )
+    async for chunk in chunks:
+        yield chunk
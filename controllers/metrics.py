@@ -0,0 +1,187 @@
+import contextvars
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+METRICS_TRACE_LOG = os.getenv("METRICS_TRACE_LOG", "false").lower() == "true"
+METRICS_PREFIX = "dripify"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+trace_logger = logging.getLogger("dripify.trace")
+if METRICS_TRACE_LOG and not trace_logger.handlers:
+    # Nothing configures logging for the app, so the trace log brings its own
+    # handler: one JSON object per line on stderr.
+    _trace_handler = logging.StreamHandler()
+    _trace_handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(_trace_handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+# Stages timed while serving the current request, for the optional trace log.
+_current_trace = contextvars.ContextVar("dripify_trace", default=None)
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self.values[self._key(labels)] += amount
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in self.values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.values[self._key(labels)] -= amount
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = []
+        for key, (bucket_counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+REGISTRY = []
+_collectors = []
+
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent in each hot-path stage.", ["stage"])
+REQUEST_SECONDS = Histogram("request_duration_seconds", "HTTP request latency by endpoint.", ["endpoint", "method", "status"])
+REQUESTS_IN_FLIGHT = Gauge("requests_in_flight", "HTTP requests currently being served.")
+WEBSOCKETS_OPEN = Gauge("websocket_connections", "Chat WebSocket connections currently open.")
+LLM_IN_FLIGHT = Gauge("llm_requests_in_flight", "LLM calls currently awaiting a response.", ["call_site"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported (or estimated for streams) per model.", ["model", "kind"])
+LLM_ERRORS = Counter("llm_errors_total", "LLM calls that raised, by model and error type.", ["model", "call_site", "error"])
+LLM_RETRIES = Counter("llm_retries_total", "LLM calls retried after a failure.", ["model", "call_site"])
+LLM_HEDGES = Counter("llm_hedged_requests_total", "Duplicate LLM requests sent because the first was slower than the hedge percentile.", ["call_site"])
+LLM_FALLBACKS = Counter("llm_fallbacks_total", "LLM calls served by the fallback model.", ["call_site", "model"])
+LLM_BREAKER_OPEN = Gauge("llm_circuit_open", "1 while the circuit breaker for a call site and model is open.", ["breaker"])
+CHAT_SESSION_FLUSHES = Counter("chat_session_flushes_total", "Write-behind flushes of cached chats, by trigger and result.", ["trigger", "result"])
+CHAT_SESSION_FLUSH_LAG = Histogram("chat_session_flush_lag_seconds", "Time from a chat turn being acknowledged to it reaching Mongo.")
+CHAT_SESSION_EVICTIONS = Counter("chat_session_evictions_total", "Chats dropped from the hot-session cache, by reason.", ["reason"])
+APP_IMPORT_SECONDS = Gauge("app_import_seconds", "Time this worker spent importing the application.")
+APP_STARTUP_SECONDS = Gauge("app_startup_seconds", "Time from the start of the import until the worker reported ready.")
+JOB_RETRIES = Counter("job_retries_total", "Background jobs rescheduled after a failure.", ["kind"])
+
+def register_collector(collector):
+    """`collector()` returns (name, kind, documentation, {labels_tuple: value}) tuples at scrape time."""
+    _collectors.append(collector)
+
+@contextmanager
+def stage_timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append((stage, elapsed))
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, documentation, samples in collector():
+            full_name = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {documentation}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in samples.items():
+                lines.append(f"{full_name}{_format_labels([label for label, _ in labels], [v for _, v in labels])} {value}")
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses pass through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_holder = {"status": 500}
+        trace = [] if METRICS_TRACE_LOG else None
+        token = _current_trace.set(trace)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            REQUESTS_IN_FLIGHT.dec()
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=scope["method"], status=status_holder["status"])
+            _current_trace.reset(token)
+            if trace is not None:
+                trace_logger.info(json.dumps({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "endpoint": endpoint,
+                    "status": status_holder["status"],
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "stages": [{"stage": stage, "ms": round(seconds * 1000, 3)} for stage, seconds in trace],
+                }))
@@ -0,0 +1,283 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+import openai
+from controllers.metrics import LLM_BREAKER_OPEN, LLM_FALLBACKS, LLM_HEDGES, LLM_RETRIES
+
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.APIError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+class CircuitOpenError(openai.error.OpenAIError):
+    pass
+
+class DeadlineExceededError(openai.error.Timeout):
+    pass
+
+def _env(call_site: str, knob: str, default):
+    value = os.getenv(f"LLM_{call_site.upper()}_{knob}")
+    if value is None:
+        return default
+    return type(default)(value) if default is not None else value
+
+class CallPolicy:
+    """Deadline, retry, hedging and circuit-breaker settings for one LLM call site.
+
+    Every knob can be overridden per site as LLM_<CALL_SITE>_<KNOB>, e.g.
+    LLM_FOLLOW_UP_DEADLINE=6 or LLM_FILLED_WORKFLOW_FALLBACK_MODEL=gpt-3.5-turbo.
+    """
+
+    def __init__(self, call_site: str, deadline: float, attempt_timeout: float, max_retries: int,
+                 backoff_base: float = 0.25, backoff_max: float = 2.0, hedge_percentile: float = 0.95,
+                 hedge_min_samples: int = 20, breaker_failures: int = 5, breaker_reset: float = 30.0,
+                 fallback_model: str = ""):
+        self.call_site = call_site
+        self.deadline = _env(call_site, "DEADLINE", deadline)
+        self.attempt_timeout = _env(call_site, "ATTEMPT_TIMEOUT", attempt_timeout)
+        self.max_retries = _env(call_site, "MAX_RETRIES", max_retries)
+        self.backoff_base = _env(call_site, "BACKOFF_BASE", backoff_base)
+        self.backoff_max = _env(call_site, "BACKOFF_MAX", backoff_max)
+        # 0 disables hedging for the call site.
+        self.hedge_percentile = _env(call_site, "HEDGE_PERCENTILE", hedge_percentile)
+        self.hedge_min_samples = _env(call_site, "HEDGE_MIN_SAMPLES", hedge_min_samples)
+        self.breaker_failures = _env(call_site, "BREAKER_FAILURES", breaker_failures)
+        self.breaker_reset = _env(call_site, "BREAKER_RESET", breaker_reset)
+        self.fallback_model = _env(call_site, "FALLBACK_MODEL", fallback_model)
+
+class LatencyTracker:
+    def __init__(self, size: int = 256):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets one trial call through per reset window."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_seconds and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release_trial(self):
+        # A trial that ended without a verdict (a non-retryable error, a
+        # cancellation) must not keep the breaker shut for good.
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        LLM_BREAKER_OPEN.set(0, breaker=self.name)
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            LLM_BREAKER_OPEN.set(1, breaker=self.name)
+
+POLICIES = {
+    "follow_up": CallPolicy("follow_up", deadline=12.0, attempt_timeout=6.0, max_retries=2),
+    "filled_workflow": CallPolicy("filled_workflow", deadline=20.0, attempt_timeout=10.0, max_retries=1),
+}
+
+_breakers = {}
+_trackers = {}
+
+def get_policy(call_site: str) -> CallPolicy:
+    if call_site not in POLICIES:
+        POLICIES[call_site] = CallPolicy(call_site, deadline=30.0, attempt_timeout=15.0, max_retries=1)
+    return POLICIES[call_site]
+
+def _breaker(policy: CallPolicy, model: str) -> CircuitBreaker:
+    key = f"{policy.call_site}:{model}"
+    if key not in _breakers:
+        _breakers[key] = CircuitBreaker(key, policy.breaker_failures, policy.breaker_reset)
+    return _breakers[key]
+
+def _tracker(policy: CallPolicy, model: str) -> LatencyTracker:
+    return _trackers.setdefault(f"{policy.call_site}:{model}", LatencyTracker())
+
+def _hedge_delay(policy: CallPolicy, model: str):
+    tracker = _tracker(policy, model)
+    if not policy.hedge_percentile or len(tracker.samples) < policy.hedge_min_samples:
+        return None
+    return tracker.percentile(policy.hedge_percentile)
+
+async def _cancel(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _hedged_attempt(policy: CallPolicy, model: str, make_call, timeout: float):
+    # Send a duplicate once the first request is slower than the site's usual
+    # tail, and take whichever answers first.
+    hedge_delay = _hedge_delay(policy, model)
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    pending = {asyncio.ensure_future(make_call())}
+    hedged = hedge_delay is None or hedge_delay >= timeout
+    error = None
+    try:
+        while pending:
+            wait_for = end - loop.time() if hedged else min(hedge_delay, end - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, wait_for), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+                if not isinstance(error, RETRYABLE_ERRORS):
+                    raise error
+            if not done:
+                if hedged or loop.time() >= end:
+                    raise asyncio.TimeoutError()
+                hedged = True
+                LLM_HEDGES.inc(call_site=policy.call_site)
+                pending.add(asyncio.ensure_future(make_call()))
+        raise error
+    finally:
+        if pending:
+            await _cancel(pending)
+
+def _backoff(policy: CallPolicy, attempt: int) -> float:
+    return random.uniform(0, min(policy.backoff_max, policy.backoff_base * 2 ** attempt))
+
+async def _call_model(policy: CallPolicy, model: str, make_call):
+    breaker = _breaker(policy, model)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {policy.call_site} on {model}")
+    trial = breaker.is_open
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline
+    attempt = 0
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            start = loop.time()
+            try:
+                result = await _hedged_attempt(policy, model, make_call, min(policy.attempt_timeout, remaining))
+            except RETRYABLE_ERRORS as e:
+                breaker.record_failure()
+                delay = _backoff(policy, attempt)
+                if attempt >= policy.max_retries or breaker.is_open or loop.time() + delay >= deadline:
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise DeadlineExceededError(f"{policy.call_site} exceeded its {policy.deadline}s deadline") from e
+                    raise
+                attempt += 1
+                LLM_RETRIES.inc(model=model, call_site=policy.call_site)
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            _tracker(policy, model).add(loop.time() - start)
+            return result
+    finally:
+        if trial:
+            breaker.release_trial()
+
+async def resilient_call(call_site: str, model: str, make_call):
+    """`make_call(model)` returns a fresh awaitable for one attempt against `model`."""
+    policy = get_policy(call_site)
+    try:
+        return await _call_model(policy, model, lambda: make_call(model))
+    except (CircuitOpenError,) + RETRYABLE_ERRORS:
+        if not policy.fallback_model or policy.fallback_model == model:
+            raise
+        LLM_FALLBACKS.inc(call_site=call_site, model=policy.fallback_model)
+        return await _call_model(policy, policy.fallback_model, lambda: make_call(policy.fallback_model))
+
+async def _open_stream(policy: CallPolicy, model: str, open_stream):
+    # Returns the open stream, its iterator and the first chunk, or None when
+    # the stream ended without output.
+    breaker = _breaker(policy, model)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit open for {policy.call_site} on {model}")
+    trial = breaker.is_open
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline
+    attempt = 0
+    try:
+        while True:
+            stream = open_stream(model)
+            iterator = stream.__aiter__()
+            timeout = min(policy.attempt_timeout, deadline - loop.time())
+            try:
+                first = await asyncio.wait_for(iterator.__anext__(), timeout)
+                break
+            except StopAsyncIteration:
+                breaker.record_success()
+                return None
+            except RETRYABLE_ERRORS as e:
+                await stream.aclose()
+                breaker.record_failure()
+                delay = _backoff(policy, attempt)
+                if attempt >= policy.max_retries or breaker.is_open or loop.time() + delay >= deadline:
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise DeadlineExceededError(f"{policy.call_site} exceeded its {policy.deadline}s deadline") from e
+                    raise
+                attempt += 1
+                LLM_RETRIES.inc(model=model, call_site=policy.call_site)
+                await asyncio.sleep(delay)
+        breaker.record_success()
+    finally:
+        if trial:
+            breaker.release_trial()
+    return stream, iterator, first
+
+async def resilient_stream(call_site: str, model: str, open_stream):
+    """Retries, breaks the circuit and falls back only until the first chunk arrives.
+
+    Once output is flowing to the client it cannot be replayed, so later
+    failures propagate; the stream is then only cut when the gap between two
+    chunks exceeds the attempt timeout.
+    """
+    policy = get_policy(call_site)
+    try:
+        opened = await _open_stream(policy, model, open_stream)
+    except (CircuitOpenError,) + RETRYABLE_ERRORS:
+        if not policy.fallback_model or policy.fallback_model == model:
+            raise
+        LLM_FALLBACKS.inc(call_site=call_site, model=policy.fallback_model)
+        opened = await _open_stream(policy, policy.fallback_model, open_stream)
+    if opened is None:
+        return
+    stream, iterator, first = opened
+    try:
+        yield first
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), policy.attempt_timeout)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError as e:
+                raise DeadlineExceededError(f"{call_site} stream stalled for more than {policy.attempt_timeout}s") from e
+            yield chunk
+    finally:
+        await stream.aclose()
@@ -0,0 +1,259 @@
+import difflib
+import os
+import re
+from collections import Counter
+from controllers.metrics import register_collector
+
+SLOT_FILL_ENABLED = os.getenv("SLOT_FILL_ENABLED", "true").lower() == "true"
+SLOT_FILL_FUZZY_CUTOFF = float(os.getenv("SLOT_FILL_FUZZY_CUTOFF", "0.85"))
+SLOT_FILL_FUZZY_MAX_WORDS = int(os.getenv("SLOT_FILL_FUZZY_MAX_WORDS", "4"))
+
+# Mirrors the reference mapping in the follow-up system prompt.
+ALLOWED_VALUES = {
+    "CampaignType": ["Welcome Series", "Product Launch", "Customer Re-engagement", "Abandoned Cart", "Seasonal Promotion", "Loyalty Program", "Newsletter", "Event Invitation"],
+    "AudienceSegment": ["New Subscribers", "Active Customers", "Inactive Customers", "High-value Customers", "First-time Buyers", "Repeat Customers", "Abandoned Cart Users"],
+    "EmailFrequency": ["Daily", "Every Other Day", "Twice a Week", "Weekly", "Bi-weekly", "Monthly"],
+    "CampaignDuration": ["3 days", "1 week", "2 weeks", "1 month", "3 months", "6 months", "Ongoing"],
+    "ContentType": ["Promotional", "Educational", "Testimonials", "Product Updates", "Company News", "User-generated Content", "Behind-the-scenes"],
+    "CallToAction": ["Shop Now", "Learn More", "Book a Demo", "Subscribe", "Claim Offer", "Join Waitlist", "RSVP"],
+    "PersonalizationLevel": ["Basic (Name)", "Intermediate (Browsing History)", "Advanced (Purchase History + Preferences)"],
+    "A/BTestingElements": ["Subject Lines", "Email Content", "Send Times", "CTAs", "Images", "Personalization Level"],
+    "SuccessMetrics": ["Open Rate", "Click-through Rate", "Conversion Rate", "Revenue Generated", "List Growth Rate", "Unsubscribe Rate"],
+}
+
+SYNONYMS = {
+    "CampaignType": {
+        "welcome": "Welcome Series", "welcome emails": "Welcome Series", "onboarding": "Welcome Series",
+        "launch": "Product Launch", "new product": "Product Launch",
+        "re engagement": "Customer Re-engagement", "reengagement": "Customer Re-engagement", "win back": "Customer Re-engagement",
+        "cart abandonment": "Abandoned Cart", "seasonal": "Seasonal Promotion", "holiday promotion": "Seasonal Promotion",
+        "loyalty": "Loyalty Program", "newsletters": "Newsletter", "event": "Event Invitation", "webinar": "Event Invitation",
+    },
+    "AudienceSegment": {
+        "new": "New Subscribers", "subscribers": "New Subscribers", "active": "Active Customers", "inactive": "Inactive Customers",
+        "high value": "High-value Customers", "vip": "High-value Customers", "first time": "First-time Buyers",
+        "repeat": "Repeat Customers", "returning customers": "Repeat Customers", "people who have bought before": "Repeat Customers",
+    },
+    "EmailFrequency": {
+        "every day": "Daily", "everyday": "Daily", "once a day": "Daily", "every 2 days": "Every Other Day",
+        "alternate days": "Every Other Day", "twice weekly": "Twice a Week", "2x a week": "Twice a Week",
+        "once a week": "Weekly", "every week": "Weekly", "biweekly": "Bi-weekly", "every two weeks": "Bi-weekly",
+        "every 2 weeks": "Bi-weekly", "fortnightly": "Bi-weekly", "once a month": "Monthly", "every month": "Monthly",
+    },
+    "CampaignDuration": {
+        "three days": "3 days", "a week": "1 week", "one week": "1 week", "two weeks": "2 weeks",
+        "a month": "1 month", "one month": "1 month", "about a month": "1 month", "three months": "3 months",
+        "a quarter": "3 months", "six months": "6 months", "half a year": "6 months",
+        "continuous": "Ongoing", "indefinitely": "Ongoing", "no end date": "Ongoing",
+    },
+    "ContentType": {
+        "promotions": "Promotional", "promo": "Promotional", "educational content": "Educational", "how to": "Educational",
+        "reviews": "Testimonials", "product news": "Product Updates", "updates": "Product Updates",
+        "company updates": "Company News", "ugc": "User-generated Content", "behind the scenes": "Behind-the-scenes",
+    },
+    "CallToAction": {
+        "buy now": "Shop Now", "shop": "Shop Now", "get more info": "Learn More", "read more": "Learn More",
+        "demo": "Book a Demo", "schedule a demo": "Book a Demo", "sign up": "Subscribe", "claim": "Claim Offer",
+        "waitlist": "Join Waitlist", "register": "RSVP",
+    },
+    "PersonalizationLevel": {
+        "basic": "Basic (Name)", "name": "Basic (Name)", "first name": "Basic (Name)",
+        "intermediate": "Intermediate (Browsing History)", "browsing history": "Intermediate (Browsing History)",
+        "advanced": "Advanced (Purchase History + Preferences)", "purchase history": "Advanced (Purchase History + Preferences)",
+    },
+    "A/BTestingElements": {
+        "subject": "Subject Lines", "subjects": "Subject Lines", "subject line": "Subject Lines", "content": "Email Content",
+        "timing": "Send Times", "send time": "Send Times", "cta": "CTAs", "call to action": "CTAs", "image": "Images",
+        "personalization": "Personalization Level",
+    },
+    "SuccessMetrics": {
+        "opens": "Open Rate", "open rate": "Open Rate", "ctr": "Click-through Rate", "clicks": "Click-through Rate",
+        "conversions": "Conversion Rate", "revenue": "Revenue Generated", "sales": "Revenue Generated",
+        "list growth": "List Growth Rate", "unsubscribes": "Unsubscribe Rate",
+    },
+}
+
+QUESTIONS = {
+    "CampaignType": "What type of campaign do you want to create?",
+    "AudienceSegment": "Which audience segment should this campaign target?",
+    "EmailFrequency": "How often should the emails go out?",
+    "CampaignDuration": "How long should the campaign run?",
+    "ContentType": "What type of content will the campaign focus on?",
+    "CallToAction": "What call to action should the emails use?",
+    "PersonalizationLevel": "What level of personalization would you like?",
+    "A/BTestingElements": "Which elements would you like to A/B test?",
+    "SuccessMetrics": "Which success metric matters most for this campaign?",
+}
+
+# Collected alongside the enumerated parameters but accepted as free text.
+FREE_TEXT_PARAMETERS = ["EndGoal", "ListName", "SavedSearch"]
+
+PARAMETER_NAMES = list(ALLOWED_VALUES) + FREE_TEXT_PARAMETERS
+
+# Answered with one or more of the allowed values, stored comma-separated.
+MULTI_VALUE_PARAMETERS = ["A/BTestingElements", "SuccessMetrics"]
+LIST_SEPARATORS = re.compile(r"\s*(?:,|;|\band\b|&)\s*", re.IGNORECASE)
+
+# Ordered from most to least specific so that e.g. "personalization level"
+# wins over the generic "test" keyword.
+QUESTION_KEYWORDS = [
+    ("PersonalizationLevel", ["personaliz"]),
+    ("A/BTestingElements", ["a/b", "ab test", "split test"]),
+    ("CallToAction", ["call to action", "call-to-action", "cta"]),
+    ("EmailFrequency", ["how often", "frequency"]),
+    ("CampaignDuration", ["how long", "duration"]),
+    ("SuccessMetrics", ["metric", "measure success", "success"]),
+    ("AudienceSegment", ["audience", "segment", "target"]),
+    ("ContentType", ["content"]),
+    ("CampaignType", ["type of campaign", "campaign type", "kind of campaign"]),
+]
+
+# Answers that ask for edits, skips or completion need the model's judgement.
+DEFER_CUES = re.compile(r"\b(done|enough|finish|finished|skip|change|instead|actually|no more|not sure|don't know)\b")
+
+SLOT_FILL_STATS = Counter()
+
+# From the most to the least certain kind of match.
+MATCH_KINDS = ["exact", "case_insensitive", "synonym", "fuzzy"]
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("-", " ").replace("_", " ")
+    text = re.sub(r"[^\w/+ ]", " ", text)
+    return " ".join(text.split())
+
+def _parameter_key(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+_PARAMETERS_BY_KEY = {_parameter_key(name): name for name in PARAMETER_NAMES}
+
+def canonical_parameter(name):
+    # "campaign type", "Campaign_Type" and "A/B Testing Elements" all name a known parameter.
+    if not isinstance(name, str):
+        return None
+    return _PARAMETERS_BY_KEY.get(_parameter_key(name))
+
+def _variants(value: str):
+    yield normalize(value)
+    if "(" in value:
+        yield normalize(value.split("(")[0])
+
+def match_value(parameter: str, text: str):
+    values = ALLOWED_VALUES[parameter]
+    raw = text.strip()
+    if raw in values:
+        return raw, "exact"
+    norm = normalize(raw)
+    for value in values:
+        if norm in _variants(value):
+            return value, "case_insensitive"
+    synonym = SYNONYMS.get(parameter, {}).get(norm)
+    if synonym:
+        return synonym, "synonym"
+    if not norm or len(norm.split()) > SLOT_FILL_FUZZY_MAX_WORDS:
+        return None
+    candidates = {variant: value for value in values for variant in _variants(value)}
+    candidates.update(SYNONYMS.get(parameter, {}))
+    scored = sorted(
+        ((difflib.SequenceMatcher(None, norm, candidate).ratio(), candidates[candidate]) for candidate in candidates),
+        reverse=True,
+    )
+    best_score, best_value = scored[0]
+    runner_up = next((score for score, value in scored[1:] if value != best_value), 0.0)
+    if best_score >= SLOT_FILL_FUZZY_CUTOFF and best_score - runner_up >= 0.05:
+        return best_value, "fuzzy"
+    return None
+
+def match_values(parameter: str, text: str):
+    # Each listed item is matched on its own; unmatched items come back as None.
+    items = [item for item in LIST_SEPARATORS.split(text) if item.strip()]
+    return [match_value(parameter, item) for item in items]
+
+def validate_update(parameter: str, value):
+    parameter = canonical_parameter(parameter)
+    if parameter is None or not isinstance(value, str) or not value.strip():
+        return None
+    if parameter in FREE_TEXT_PARAMETERS:
+        return value.strip()
+    match = match_value(parameter, value)
+    if match:
+        return match[0]
+    if parameter not in MULTI_VALUE_PARAMETERS:
+        return None
+    values = list(dict.fromkeys(match[0] for match in match_values(parameter, value) if match))
+    return ", ".join(values) or None
+
+def validate_updates(updates: list):
+    # Each update stands on its own: a bad value for one parameter does not
+    # discard the others the user gave in the same reply.
+    accepted = {}
+    for update in updates:
+        if not isinstance(update, dict) or not update.get("valid", True):
+            continue
+        parameter = canonical_parameter(update.get("parameter"))
+        value = validate_update(parameter, update.get("value"))
+        if value is not None:
+            accepted[parameter] = value
+    return accepted
+
+def infer_parameter(question: str, collected_info: dict):
+    text = question.lower()
+    matched = [parameter for parameter, keywords in QUESTION_KEYWORDS if any(keyword in text for keyword in keywords)]
+    if not matched:
+        return None
+    missing = [parameter for parameter in matched if parameter not in collected_info]
+    return (missing or matched)[0]
+
+def next_question(parameter: str) -> str:
+    examples = ", ".join(ALLOWED_VALUES[parameter][:3])
+    return f"{QUESTIONS[parameter]} For example: {examples}, etc."
+
+def fast_fill(last_question: str, user_response: str, collected_info: dict):
+    if not SLOT_FILL_ENABLED:
+        return None
+    SLOT_FILL_STATS["turns"] += 1
+    if DEFER_CUES.search(user_response.lower()):
+        return None
+    parameter = infer_parameter(last_question, collected_info)
+    if parameter is None:
+        return None
+    match = match_value(parameter, user_response)
+    if match is None and parameter in MULTI_VALUE_PARAMETERS:
+        # A list is answered locally only when every item in it matched.
+        matches = match_values(parameter, user_response)
+        if len(matches) > 1 and all(matches):
+            values = list(dict.fromkeys(value for value, _ in matches))
+            match = ", ".join(values), max((kind for _, kind in matches), key=MATCH_KINDS.index)
+    if match is None:
+        return None
+    remaining = [name for name in ALLOWED_VALUES if name != parameter and name not in collected_info]
+    if not remaining:
+        # The last enumerated answer goes to the model so it can confirm and finish.
+        return None
+    value, kind = match
+    SLOT_FILL_STATS["short_circuited"] += 1
+    SLOT_FILL_STATS[f"match_{kind}"] += 1
+    return {
+        "updates": [{"parameter": parameter, "value": value, "valid": True}],
+        "message": f"Got it, {value}.",
+        "next_question": next_question(remaining[0]),
+        "finished": False,
+    }
+
+def slot_fill_stats():
+    turns = SLOT_FILL_STATS["turns"]
+    short_circuited = SLOT_FILL_STATS["short_circuited"]
+    return {
+        "enabled": SLOT_FILL_ENABLED,
+        "turns": turns,
+        "short_circuited": short_circuited,
+        "short_circuit_rate": short_circuited / turns if turns else 0.0,
+        "matches": {kind: SLOT_FILL_STATS[f"match_{kind}"] for kind in MATCH_KINDS},
+    }
+
+def _slot_fill_metrics():
+    yield "slot_fill_turns_total", "counter", "Chat turns offered to the local slot matcher.", {(): SLOT_FILL_STATS["turns"]}
+    yield "slot_fill_short_circuits_total", "counter", "Chat turns answered without calling the LLM, by match kind.", {
+        (("match", kind),): SLOT_FILL_STATS[f"match_{kind}"] for kind in MATCH_KINDS
+    }
+
+register_collector(_slot_fill_metrics)
@@ -0,0 +1,64 @@
+import json
+import re
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def ws_frame(event: str, data) -> str:
+    return json.dumps({"event": event, "data": data}, default=str)
+
+def _is_high_surrogate(hex_digits: str) -> bool:
+    try:
+        return 0xD800 <= int(hex_digits, 16) <= 0xDBFF
+    except ValueError:
+        return False
+
+def _partial_string(buffer: str, start: int):
+    # Decode as much of the JSON string starting at `start` as is complete,
+    # stopping short of a dangling escape sequence.
+    i = start
+    while i < len(buffer):
+        char = buffer[i]
+        if char == '"':
+            break
+        if char == "\\":
+            width = 6 if buffer[i + 1:i + 2] == "u" else 2
+            if i + width > len(buffer):
+                break
+            # Characters outside the BMP arrive as a \ud83d\ude00 pair; hold the
+            # high half back until the low half is in, or it decodes on its own.
+            pair_pending = i + 12 > len(buffer) and "\\u".startswith(buffer[i + 6:i + 8])
+            if width == 6 and pair_pending and _is_high_surrogate(buffer[i + 2:i + 6]):
+                break
+            i += width
+            continue
+        i += 1
+    return json.loads('"' + buffer[start:i] + '"')
+
+class PartialJSONFields:
+    """Pulls top-level string fields out of function-call arguments while they stream in."""
+
+    def __init__(self, fields):
+        self.buffer = ""
+        self._patterns = {field: re.compile(r'[{,]\s*"%s"\s*:\s*"' % re.escape(field)) for field in fields}
+        self._starts = {}
+        self._emitted = {field: 0 for field in fields}
+
+    def feed(self, chunk: str):
+        self.buffer += chunk
+        deltas = []
+        for field, pattern in self._patterns.items():
+            if field not in self._starts:
+                match = pattern.search(self.buffer)
+                if not match:
+                    continue
+                self._starts[field] = match.end()
+            value = _partial_string(self.buffer, self._starts[field])
+            sent = self._emitted[field]
+            if len(value) > sent:
+                deltas.append((field, value[sent:]))
+                self._emitted[field] = len(value)
+        return deltas
+
+    def result(self):
+        return json.loads(self.buffer)
@@ -0,0 +1,43 @@
+import json
+import os
+import re
+from functools import lru_cache
+
+TEMPLATE_DIR = os.getenv("WORKFLOW_TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"))
+DEFAULT_WORKFLOW_TEMPLATE = os.getenv("WORKFLOW_TEMPLATE", "create_campaign")
+MISSING_VALUE = "N/A"
+
+PLACEHOLDER = re.compile(r"\{([A-Za-z_][\w/]*)\}")
+
+@lru_cache(maxsize=None)
+def load_workflow_template(name: str = DEFAULT_WORKFLOW_TEMPLATE):
+    with open(os.path.join(TEMPLATE_DIR, f"{name}.json"), "r") as file:
+        return json.load(file)
+
+def render_string(text: str, values: dict) -> str:
+    if "{" not in text:
+        return text
+    return PLACEHOLDER.sub(lambda match: str(values.get(match.group(1)) or MISSING_VALUE), text)
+
+def render(node, values: dict):
+    if isinstance(node, str):
+        return render_string(node, values)
+    if isinstance(node, dict):
+        return {key: render(value, values) for key, value in node.items()}
+    if isinstance(node, list):
+        return [render(item, values) for item in node]
+    return node
+
+def template_values(campaign_info: dict, name: str = DEFAULT_WORKFLOW_TEMPLATE, overrides: dict = None):
+    template = load_workflow_template(name)
+    values = {**campaign_info, **(overrides or {})}
+    # Defaults render in order, so a later one can build on an earlier one
+    # (or on its override), e.g. ListName on endGoal.
+    for key, default in template.get("defaults", {}).items():
+        if not values.get(key):
+            values[key] = render_string(default, values)
+    return values
+
+def render_workflow(campaign_info: dict, name: str = DEFAULT_WORKFLOW_TEMPLATE, overrides: dict = None):
+    values = template_values(campaign_info, name, overrides)
+    return render(load_workflow_template(name)["workflow"], values)
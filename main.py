@@ -1,6 +1,18 @@
+import time
+_import_started = time.perf_counter()
+import asyncio
+import logging
 from fastapi import FastAPI, Request, status
-from routes.routes import router as api_router
-from config.db import connect_mongodb
+from pymongo.errors import PyMongoError
+from routes.routes import router as api_router, metrics_router, health_router
+from config.db import connect_mongodb, close_mongodb, ping_mongodb
+from controllers.llm import start_llm_client, close_llm_client
+from controllers.cache import ensure_workflow_cache_indexes
+from repositories.chat_sessions import create_workflow_chat_store
+from storage.artifacts import create_artifact_store
+from controllers.controllers import create_job_queue
+from controllers.templates import load_workflow_template
+from controllers.metrics import APP_IMPORT_SECONDS, APP_STARTUP_SECONDS, MetricsMiddleware
 import uvicorn
 from dotenv import dotenv_values
 from supertokens_python import init, InputAppInfo, SupertokensConfig
@@ -29,12 +41,73 @@ init(
     mode='asgi'
 )
 
+logger = logging.getLogger("dripify.startup")
+
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.ready = False
 
 @app.on_event("startup")
-def connect_db() :
-    connection_mongo = connect_mongodb(app)
+async def connect_db() :
+    connection_mongo = await connect_mongodb(app)
     print(connection_mongo)
+    app.workflow_chats = create_workflow_chat_store(app.database)
+    await app.workflow_chats.start()
+
+@app.on_event("startup")
+async def start_jobs() :
+    app.job_queue = create_job_queue(app.database)
+    await app.job_queue.start()
+
+@app.on_event("startup")
+async def start_llm() :
+    await start_llm_client()
+
+async def warm_up() :
+    # Runs behind startup so the worker boots without waiting on Mongo; /readyz
+    # keeps it out of rotation until this has finished.
+    delay = 1
+    while True:
+        try:
+            await ping_mongodb(app)
+            await ensure_workflow_cache_indexes(app.database)
+            await app.workflow_chats.ensure_indexes()
+            await create_artifact_store(app.database).ensure_indexes()
+            await app.job_queue.ensure_indexes()
+            break
+        except PyMongoError:
+            logger.exception("MongoDB not reachable yet, retrying in %ss", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+    load_workflow_template()
+    app.ready = True
+    APP_STARTUP_SECONDS.set(time.perf_counter() - _import_started)
+
+@app.on_event("startup")
+async def start_warm_up() :
+    app.warm_up_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def stop_warm_up() :
+    app.ready = False
+    app.warm_up_task.cancel()
+    await asyncio.gather(app.warm_up_task, return_exceptions=True)
+
+@app.on_event("shutdown")
+async def stop_jobs() :
+    await app.job_queue.stop()
+
+@app.on_event("shutdown")
+async def flush_chat_sessions() :
+    await app.workflow_chats.stop()
+
+@app.on_event("shutdown")
+async def close_db() :
+    await close_mongodb(app)
+
+@app.on_event("shutdown")
+async def close_llm() :
+    await close_llm_client()
 
 @app.exception_handler(UnauthorisedError)
 async def invalid_session_exception_handler(request: Request, exc: UnauthorisedError):
@@ -51,6 +124,10 @@ async def invalid_session_exception_handler(request: Request, exc: TryRefreshTok
     )
 
 app.include_router(api_router)
+app.include_router(metrics_router)
+app.include_router(health_router)
+
+APP_IMPORT_SECONDS.set(time.perf_counter() - _import_started)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host='0.0.0.0', port=8000)
\ No newline at end of file
@@ -8,11 +8,15 @@ from datetime import date
 class WorkflowChatMessage(BaseModel):
     question: str
     response: Optional[str] = None
+    prompt_tokens: Optional[int] = None
 
 class WorkflowChat(BaseModel) :
     id: str = Field(default_factory=uuid.uuid4, alias="_id")
     workflowid: str
     messages: List[WorkflowChatMessage]
+    collected_info: dict = Field(default_factory=dict)
+    is_completed: bool = False
+    version: int = 0
 
     class Config:
         json_schema_extra = {
@@ -0,0 +1,270 @@
+import asyncio
+import copy
+import logging
+import os
+import time
+import weakref
+from collections import OrderedDict
+from fastapi import HTTPException
+from pymongo.errors import PyMongoError
+from controllers.metrics import CHAT_SESSION_EVICTIONS, CHAT_SESSION_FLUSHES, CHAT_SESSION_FLUSH_LAG, register_collector
+from repositories.repositories import WORKFLOW_CHAT_COLLECTION, WorkflowChatRepository
+
+CHAT_SESSION_CACHE_ENABLED = os.getenv("CHAT_SESSION_CACHE_ENABLED", "true").lower() == "true"
+CHAT_SESSION_MAX_ENTRIES = int(os.getenv("CHAT_SESSION_MAX_ENTRIES", "10000"))
+CHAT_SESSION_IDLE_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "600"))
+CHAT_SESSION_FLUSH_INTERVAL = float(os.getenv("CHAT_SESSION_FLUSH_INTERVAL", "1"))
+# "sync" writes every turn through to Mongo before acknowledging it. "async"
+# acknowledges a turn once it is held in memory and flushes it behind; only use
+# it with a single worker, or with sticky routing by chatId.
+CHAT_SESSION_DURABILITY = os.getenv("CHAT_SESSION_DURABILITY", "sync").lower()
+# Read the stored version before answering from a cached chat. Only needed when
+# other workers write the same chats (no sticky routing); it costs a read per
+# turn, so the cache then saves nothing on reads.
+CHAT_SESSION_VERIFY_VERSION = os.getenv("CHAT_SESSION_VERIFY_VERSION", "false").lower() == "true"
+
+logger = logging.getLogger("dripify.chat_sessions")
+
+_caches = weakref.WeakSet()
+
+class _Session:
+    def __init__(self, chat: dict, keep: int, truncated: bool):
+        self.chat = chat
+        self.keep = keep
+        # False while `messages` still holds the whole transcript.
+        self.truncated = truncated
+        self.persisted_version = chat.get("version") or 0
+        self.pending = []
+        # Set when a write-behind flush lost to a write from another worker.
+        self.conflicted = False
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def view(self, max_turns: int):
+        chat = copy.deepcopy(self.chat)
+        chat["messages"] = chat["messages"][-(max_turns + 1):]
+        return chat
+
+class ChatSessionCache:
+    """Active chats held in memory, with turns written behind to Mongo.
+
+    Serves the same calls as WorkflowChatRepository. Turns on a cached chat are
+    applied in memory and coalesced into one update per flush; the flush is
+    guarded by the persisted version, so a chat changed by another worker is
+    never overwritten, and turns that can no longer be written surface as a 409
+    instead of being lost quietly. A cached turn reads nothing from Mongo unless
+    verify_version is set for deployments where several workers share chats.
+    """
+
+    def __init__(self, repository: WorkflowChatRepository, enabled: bool = CHAT_SESSION_CACHE_ENABLED,
+                 max_entries: int = CHAT_SESSION_MAX_ENTRIES, idle_seconds: float = CHAT_SESSION_IDLE_SECONDS,
+                 flush_interval: float = CHAT_SESSION_FLUSH_INTERVAL, durability: str = CHAT_SESSION_DURABILITY,
+                 verify_version: bool = CHAT_SESSION_VERIFY_VERSION):
+        self.repository = repository
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.verify_version = verify_version
+        self._sessions = OrderedDict()
+        self._task = None
+        _caches.add(self)
+
+    async def ensure_indexes(self):
+        await self.repository.ensure_indexes()
+
+    async def create(self, document: dict):
+        inserted_id = await self.repository.create(document)
+        if self.enabled and inserted_id:
+            await self._admit(str(inserted_id), _Session(copy.deepcopy(document), keep=len(document["messages"]), truncated=False))
+        return inserted_id
+
+    async def load_turn_state(self, chat_id: str, max_turns: int):
+        if not self.enabled:
+            return await self.repository.load_turn_state(chat_id, max_turns)
+        session = self._sessions.get(chat_id)
+        if session is not None and (session.conflicted or self.verify_version):
+            session = await self._check_version(chat_id, session)
+        if session is not None and (not session.truncated or len(session.chat["messages"]) > max_turns):
+            self._sessions.move_to_end(chat_id)
+            session.keep = max(session.keep, max_turns + 1)
+            session.last_used = time.monotonic()
+            return session.view(max_turns)
+        # More history is wanted than the cache kept; reread it from Mongo.
+        if session is not None and not await self._drop(chat_id, session, "reload"):
+            return session.view(max_turns)
+        chat = await self.repository.load_turn_state(chat_id, max_turns)
+        if chat is None:
+            return None
+        session = _Session(chat, keep=max_turns + 1, truncated=len(chat["messages"]) > max_turns)
+        await self._admit(chat_id, session)
+        return session.view(max_turns)
+
+    async def _check_version(self, chat_id: str, session: _Session):
+        # One indexed, projected read, far cheaper than reloading the transcript.
+        if not session.conflicted and await self.repository.stored_version(chat_id) == session.persisted_version:
+            return session
+        if self._sessions.get(chat_id) is session:
+            del self._sessions[chat_id]
+        if session.pending or session.conflicted:
+            CHAT_SESSION_EVICTIONS.inc(reason="conflict")
+            logger.error("Chat %s was changed by another worker; %d unflushed turn(s) were not saved",
+                         chat_id, len(session.pending))
+            raise HTTPException(status_code=409, detail="Workflow chat was updated by another request, please reload it")
+        CHAT_SESSION_EVICTIONS.inc(reason="stale")
+        return None
+
+    def find_completed(self, **kwargs):
+        # Completion is flushed synchronously, so Mongo already has every completed chat.
+        return self.repository.find_completed(**kwargs)
+
+    async def append_turn(self, chat_id: str, version: int, user_response: str, new_message: dict,
+                          updates: dict, extra_fields: dict = None):
+        session = self._sessions.get(chat_id) if self.enabled else None
+        if session is None:
+            return await self.repository.append_turn(chat_id, version, user_response, new_message, updates, extra_fields)
+        turn = (user_response, copy.deepcopy(new_message), dict(updates), dict(extra_fields or {}), time.monotonic())
+        async with session.lock:
+            if session.conflicted or (session.chat.get("version") or 0) != (version or 0):
+                return False
+            if self.durability != "sync" and not extra_fields:
+                self._apply(session, turn)
+                session.pending.append(turn)
+                return True
+            # Completion is read by other workers (exports, process_workflow), so it
+            # is not deferred. The turn reaches the session only once it is written.
+            saved = await self._write(chat_id, session, "sync" if self.durability == "sync" else "completion", [turn])
+            if saved:
+                self._apply(session, turn)
+        if not saved and self._sessions.get(chat_id) is session:
+            # This request already answers with a 409; the next one reloads from Mongo.
+            del self._sessions[chat_id]
+            CHAT_SESSION_EVICTIONS.inc(reason="conflict")
+        return saved
+
+    def _apply(self, session: _Session, turn):
+        user_response, new_message, updates, extra_fields, _ = turn
+        chat = session.chat
+        chat["messages"][-1]["response"] = user_response
+        chat["messages"].append(copy.deepcopy(new_message))
+        if len(chat["messages"]) > session.keep:
+            chat["messages"] = chat["messages"][-session.keep:]
+            session.truncated = True
+        chat.setdefault("collected_info", {}).update(updates)
+        chat.update(extra_fields)
+        chat["version"] = (chat.get("version") or 0) + 1
+        session.last_used = time.monotonic()
+
+    async def _flush(self, chat_id: str, session: _Session, trigger: str) -> bool:
+        async with session.lock:
+            return await self._write(chat_id, session, trigger, [])
+
+    async def _write(self, chat_id: str, session: _Session, trigger: str, turns: list) -> bool:
+        # Writes the pending turns plus `turns`, which are not yet applied to the
+        # session. Called with the session lock held.
+        pending = session.pending
+        batch = pending + turns
+        if not batch:
+            return True
+        if session.conflicted:
+            return False
+        updates, extra_fields = {}, {}
+        for _, _, turn_updates, turn_extra, _ in batch:
+            updates.update(turn_updates)
+            extra_fields.update(turn_extra)
+        try:
+            saved = await self.repository.append_turns(
+                chat_id, session.persisted_version, [(user_response, new_message) for user_response, new_message, _, _, _ in batch],
+                updates, extra_fields,
+            )
+        except PyMongoError:
+            CHAT_SESSION_FLUSHES.inc(trigger=trigger, result="error")
+            raise
+        if not saved:
+            CHAT_SESSION_FLUSHES.inc(trigger=trigger, result="conflict")
+            # Pending turns stay with the session, which answers the chat's next
+            # load with a 409 and then drops out of the cache.
+            session.conflicted = True
+            logger.warning("Could not flush %d turn(s) for chat %s after a version conflict", len(batch), chat_id)
+            return False
+        session.pending = []
+        session.persisted_version += len(batch)
+        CHAT_SESSION_FLUSHES.inc(trigger=trigger, result="ok")
+        CHAT_SESSION_FLUSH_LAG.observe(time.monotonic() - batch[0][4])
+        return True
+
+    async def _drop(self, chat_id: str, session: _Session, reason: str) -> bool:
+        # Unflushed turns go out first; a chat whose flush fails stays cached.
+        try:
+            await self._flush(chat_id, session, "eviction")
+        except PyMongoError:
+            logger.exception("Could not flush chat %s before eviction", chat_id)
+            return False
+        if self._sessions.get(chat_id) is session:
+            del self._sessions[chat_id]
+            CHAT_SESSION_EVICTIONS.inc(reason=reason)
+        return True
+
+    async def _admit(self, chat_id: str, session: _Session):
+        self._sessions[chat_id] = session
+        self._sessions.move_to_end(chat_id)
+        while len(self._sessions) > self.max_entries:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if not await self._drop(oldest_id, oldest, "capacity"):
+                break
+
+    async def flush_all(self, trigger: str = "timer"):
+        for chat_id, session in list(self._sessions.items()):
+            if not session.pending or session.conflicted:
+                continue
+            try:
+                await self._flush(chat_id, session, trigger)
+            except PyMongoError:
+                logger.exception("Could not flush chat %s", chat_id)
+
+    async def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for chat_id, session in list(self._sessions.items()):
+            if session.last_used < cutoff:
+                await self._drop(chat_id, session, "idle")
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_all()
+            await self._evict_idle()
+
+    def snapshot(self):
+        sessions = list(self._sessions.values())
+        now = time.monotonic()
+        oldest = min((session.pending[0][4] for session in sessions if session.pending), default=None)
+        return {
+            "entries": len(sessions),
+            "dirty_entries": sum(1 for session in sessions if session.pending),
+            "pending_turns": sum(len(session.pending) for session in sessions),
+            "oldest_pending_seconds": now - oldest if oldest is not None else 0.0,
+        }
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush_all("shutdown")
+
+def create_workflow_chat_store(database):
+    return ChatSessionCache(WorkflowChatRepository(database[WORKFLOW_CHAT_COLLECTION]))
+
+def _chat_session_metrics():
+    snapshots = [cache.snapshot() for cache in list(_caches)]
+    yield "chat_sessions_cached", "gauge", "Workflow chats held in the hot-session cache.", {(): sum(s["entries"] for s in snapshots)}
+    yield "chat_sessions_dirty", "gauge", "Cached chats with turns not yet flushed to Mongo.", {(): sum(s["dirty_entries"] for s in snapshots)}
+    yield "chat_session_pending_turns", "gauge", "Chat turns waiting for the write-behind flush.", {(): sum(s["pending_turns"] for s in snapshots)}
+    yield "chat_session_oldest_pending_seconds", "gauge", "Age of the oldest unflushed chat turn.", {(): max((s["oldest_pending_seconds"] for s in snapshots), default=0.0)}
+
+register_collector(_chat_session_metrics)
@@ -0,0 +1,116 @@
+import os
+from fastapi import Request
+from pymongo import ASCENDING, ReadPreference
+from controllers.metrics import stage_timer
+
+WORKFLOW_COLLECTION = "workflows"
+WORKFLOW_CHAT_COLLECTION = "workflowchats"
+
+# Bulk exports read from a secondary when the deployment has one, keeping
+# the scan off the primary that serves live chats.
+EXPORT_READ_FROM_SECONDARY = os.getenv("EXPORT_READ_FROM_SECONDARY", "true").lower() == "true"
+
+def version_filter(chat_id: str, version: int):
+    # Chats created before versioning have no field; treat them as version 0.
+    return {"_id": chat_id, "version": version if version else {"$in": [0, None]}}
+
+class WorkflowRepository:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, workflow_id: str):
+        with stage_timer("mongo.workflows.find_one"):
+            return await self.collection.find_one({"_id": workflow_id})
+
+class WorkflowChatRepository:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("workflowid", ASCENDING)])
+        await self.collection.create_index([("is_completed", ASCENDING)])
+        await self.collection.create_index([("is_completed", ASCENDING), ("_id", ASCENDING)])
+
+    async def create(self, document: dict):
+        with stage_timer("mongo.workflowchats.insert_one"):
+            result = await self.collection.insert_one(document)
+        return result.inserted_id
+
+    async def load_turn_state(self, chat_id: str, max_turns: int):
+        # Only the pending question and the turns the context builder can use are
+        # read back, however long the conversation has grown.
+        projection = {
+            "workflowid": 1,
+            "collected_info": 1,
+            "version": 1,
+            "is_completed": 1,
+            "messages": {"$slice": -(max_turns + 1)},
+        }
+        with stage_timer("mongo.workflowchats.find_one"):
+            return await self.collection.find_one({"_id": chat_id}, projection)
+
+    async def stored_version(self, chat_id: str):
+        # None when the chat does not exist; 0 for chats created before versioning.
+        with stage_timer("mongo.workflowchats.find_one"):
+            document = await self.collection.find_one({"_id": chat_id}, {"version": 1})
+        return None if document is None else document.get("version") or 0
+
+    async def append_turn(self, chat_id: str, version: int, user_response: str, new_message: dict,
+                          updates: dict, extra_fields: dict = None):
+        return await self.append_turns(chat_id, version, [(user_response, new_message)], updates, extra_fields)
+
+    async def append_turns(self, chat_id: str, version: int, turns: list, updates: dict, extra_fields: dict = None):
+        # `turns` holds (user_response, new_message) pairs, oldest first; each reply
+        # answers the question before it. A $set on messages.<n>.response cannot
+        # share an update with a $push onto messages, so the append is a single
+        # pipeline stage. Only the new turns and the changed parameters travel
+        # over the wire either way.
+        last_index = {"$subtract": [{"$size": "$messages"}, 1]}
+        answered = {"$mergeObjects": [{"$arrayElemAt": ["$messages", -1]}, {"response": {"$literal": turns[0][0]}}]}
+        new_messages = [
+            {**new_message, "response": next_response}
+            for (_, new_message), (next_response, _) in zip(turns, turns[1:])
+        ] + [turns[-1][1]]
+        stage = {
+            "messages": {"$concatArrays": [
+                {"$cond": [{"$gt": [last_index, 0]}, {"$slice": ["$messages", last_index]}, []]},
+                [answered],
+                {"$literal": new_messages},
+            ]},
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, len(turns)]},
+        }
+        for parameter, value in updates.items():
+            stage[f"collected_info.{parameter}"] = {"$literal": value}
+        for field, value in (extra_fields or {}).items():
+            stage[field] = {"$literal": value}
+        with stage_timer("mongo.workflowchats.update_one"):
+            result = await self.collection.update_one(version_filter(chat_id, version), [{"$set": stage}])
+        return result.matched_count == 1
+
+    def find_completed(self, after_id: str = None, workflowid: str = None, since=None, until=None,
+                       include_messages: bool = False, batch_size: int = 500, limit: int = 0):
+        # Keyset pagination on _id: resuming never re-scans what was already sent.
+        query = {"is_completed": True}
+        if after_id is not None:
+            query["_id"] = {"$gt": after_id}
+        if workflowid is not None:
+            query["workflowid"] = workflowid
+        if since is not None or until is not None:
+            query["completedAt"] = {
+                **({"$gte": since} if since is not None else {}),
+                **({"$lt": until} if until is not None else {}),
+            }
+        projection = {"workflowid": 1, "collected_info": 1, "completedAt": 1, "campaign_info_artifact": 1}
+        if include_messages:
+            projection["messages"] = 1
+        collection = self.collection
+        if EXPORT_READ_FROM_SECONDARY:
+            collection = collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+        return collection.find(query, projection).sort("_id", ASCENDING).batch_size(batch_size).limit(limit)
+
+def get_workflow_repository(request: Request):
+    return WorkflowRepository(request.app.database[WORKFLOW_COLLECTION])
+
+def get_workflow_chat_repository(request: Request):
+    # The hot-session cache created at startup, which falls through to Mongo.
+    return request.app.workflow_chats
@@ -1,36 +1,161 @@
-from fastapi import APIRouter, Request, status
+from fastapi import APIRouter, HTTPException, Request, WebSocket, status
 from typing import List, Optional
+from datetime import datetime
 from models.model import *
 from controllers.controllers import *
+from controllers.slot_filling import slot_fill_stats
+from controllers.cache import follow_up_cache, workflow_cache
 from supertokens_python.recipe.session.framework.fastapi import verify_session
 from supertokens_python.recipe.session import SessionContainer
+from supertokens_python.recipe.session.asyncio import get_session_without_request_response
+from supertokens_python.recipe.session.exceptions import TryRefreshTokenError, UnauthorisedError
 from fastapi import Depends
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from controllers.metrics import render_prometheus, stage_timer
+from controllers.health import readiness
 from pydantic import BaseModel
+import os
 
 class ContinueChat(BaseModel) :
     chatId: str
     user_response: str
+    # Skip the follow-up response cache, e.g. when a fresh completion is wanted.
+    bypass_cache: bool = False
+
+class ProcessWorkflowBatch(BaseModel):
+    chat_ids: List[str]
 
 class ApiResponse(BaseModel):
     workFlowChatId: str
     question: str
 
+_verify_session = verify_session()
+
+async def timed_verify_session(request: Request):
+    with stage_timer("verify_session"):
+        return await _verify_session(request)
+
+# Browsers attach session cookies to cross-site WebSocket handshakes, so the
+# Origin is checked in place of the anti-CSRF token.
+WEBSOCKET_ALLOWED_ORIGINS = [origin for origin in os.getenv("WEBSOCKET_ALLOWED_ORIGINS", "http://localhost:3000").split(",") if origin]
+
+async def verify_websocket_session(websocket: WebSocket):
+    origin = websocket.headers.get("origin")
+    if origin is not None and origin not in WEBSOCKET_ALLOWED_ORIGINS:
+        return None
+    access_token = websocket.cookies.get("sAccessToken")
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        access_token = authorization[7:]
+    if not access_token:
+        return None
+    with stage_timer("verify_session"):
+        try:
+            return await get_session_without_request_response(access_token, anti_csrf_check=False)
+        except (UnauthorisedError, TryRefreshTokenError):
+            return None
+
+# The bulk export carries every user's answers and transcripts, so it is
+# limited to analytics accounts: listed user ids, or sessions holding one of
+# the listed SuperTokens roles. Any other session gets a 403.
+EXPORT_ALLOWED_USER_IDS = [user_id for user_id in os.getenv("EXPORT_ALLOWED_USER_IDS", "").split(",") if user_id]
+EXPORT_ALLOWED_ROLES = [role for role in os.getenv("EXPORT_ALLOWED_ROLES", "admin,analytics").split(",") if role]
+
+async def verify_export_session(session: SessionContainer = Depends(timed_verify_session)):
+    roles = (session.get_access_token_payload().get("st-role") or {}).get("v") or []
+    if session.get_user_id() in EXPORT_ALLOWED_USER_IDS or any(role in EXPORT_ALLOWED_ROLES for role in roles):
+        return session
+    raise HTTPException(status_code=403, detail="Exports are limited to analytics accounts")
+
 router = APIRouter(prefix="/workflowchat", tags=["workflow_chat"])
+metrics_router = APIRouter(tags=["metrics"])
+health_router = APIRouter(tags=["health"])
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@health_router.get("/healthz", include_in_schema=False)
+async def healthz():
+    # Liveness only: the process is up and the event loop is answering.
+    return {"status": "ok"}
+
+@health_router.get("/readyz", include_in_schema=False)
+async def readyz(request: Request):
+    ready, checks = await readiness(request.app)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "not_ready", "checks": checks},
+    )
 
 @router.post("/trigger/{workflowid}", response_description="trigger a workflow chat and return greet message along with chat Id", status_code=status.HTTP_201_CREATED, response_model=ApiResponse)  
-def trigger(request: Request, workflowid: str, session: SessionContainer = Depends(verify_session())):
-    return trigger_workflow_chat(request, workflowid)
+async def trigger(request: Request, workflowid: str, session: SessionContainer = Depends(timed_verify_session)):
+    return await trigger_workflow_chat(request, workflowid)
 
 @router.post("/continuechat", response_description="will return the chat Id and the next question", status_code=status.HTTP_200_OK)
-def continue_chat(request: Request, resp_body: ContinueChat, session: SessionContainer = Depends(verify_session())):
+async def continue_chat(request: Request, resp_body: ContinueChat, session: SessionContainer = Depends(timed_verify_session)):
+    chatid = resp_body.chatId
+    user_response = resp_body.user_response
+    return await continue_workflow_chat(request, chatid, user_response, resp_body.bypass_cache)
+
+@router.post("/continuechat/stream", response_description="will stream the reply and next question as server-sent events", status_code=status.HTTP_200_OK)
+async def continue_chat_stream(request: Request, resp_body: ContinueChat, session: SessionContainer = Depends(timed_verify_session)):
     chatid = resp_body.chatId
     user_response = resp_body.user_response
-    return continue_workflow_chat(request, chatid, user_response)
-
-@router.post("/process_workflow/{chat_id}", response_description="Process campaign info and save filled workflow", status_code=status.HTTP_200_OK)
-def process_workflow(chat_id: str):
-    try:
-        filled_workflow = process_and_save_filled_workflow(chat_id)
-        return {"message": "Workflow processed and saved successfully", "filled_workflow": filled_workflow}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+    workflow_chat, context = await load_workflow_chat_turn(request, chatid, user_response)
+    return StreamingResponse(
+        stream_workflow_chat(request, chatid, workflow_chat, context, user_response, resp_body.bypass_cache),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/ws/{chatId}")
+async def workflow_chat_socket(websocket: WebSocket, chatId: str):
+    # Authenticated once at the handshake; every turn after that is a frame.
+    session = await verify_websocket_session(websocket)
+    if session is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    await serve_workflow_chat_socket(websocket, chatId)
+
+@router.get("/slotfill/stats", response_description="how often chat turns were answered locally without calling the LLM", status_code=status.HTTP_200_OK)
+async def slot_fill_statistics(session: SessionContainer = Depends(timed_verify_session)):
+    return slot_fill_stats()
+
+@router.get("/cache/stats", response_description="hit, miss and eviction counters for the filled workflow cache", status_code=status.HTTP_200_OK)
+async def workflow_cache_statistics(session: SessionContainer = Depends(timed_verify_session)):
+    return workflow_cache.snapshot()
+
+@router.get("/cache/followup/stats", response_description="hit rates per turn index for the memoized follow-up responses", status_code=status.HTTP_200_OK)
+async def follow_up_cache_statistics(session: SessionContainer = Depends(timed_verify_session)):
+    return follow_up_cache.snapshot()
+
+@router.get("/export", response_description="completed chats and their generated workflows as NDJSON, resumable with the returned cursor", status_code=status.HTTP_200_OK)
+async def export_chats(request: Request, cursor: Optional[str] = None, workflowid: Optional[str] = None,
+                       since: Optional[datetime] = None, until: Optional[datetime] = None, limit: int = 0,
+                       batch_size: Optional[int] = None, include_workflows: bool = True, include_messages: bool = False,
+                       session: SessionContainer = Depends(verify_export_session)):
+    # Decoded up front so a bad cursor is a 400 rather than a broken stream.
+    after_id = decode_export_cursor(cursor)
+    return StreamingResponse(
+        export_completed_chats(request, after_id, workflowid, since, until, max(limit, 0), batch_size, include_workflows, include_messages),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/process_workflow/batch", response_description="Queue filled workflow generation for many completed chats", status_code=status.HTTP_202_ACCEPTED)
+async def process_workflow_batch(request: Request, resp_body: ProcessWorkflowBatch, session: SessionContainer = Depends(timed_verify_session)):
+    return await enqueue_process_workflow_batch(request, resp_body.chat_ids)
+
+@router.post("/process_workflow/{chat_id}", response_description="Queue processing of campaign info and return the job id", status_code=status.HTTP_202_ACCEPTED)
+async def process_workflow(request: Request, chat_id: str):
+    return await enqueue_process_workflow(request, chat_id)
+
+@router.get("/jobs/batch/{batch_id}", response_description="Status of every job in a process_workflow batch", status_code=status.HTTP_200_OK)
+async def process_workflow_batch_status(request: Request, batch_id: str, session: SessionContainer = Depends(timed_verify_session)):
+    return await get_process_workflow_batch(request, batch_id)
+
+@router.get("/jobs/{job_id}", response_description="Status of a process_workflow job and the filled workflow once it succeeded", status_code=status.HTTP_200_OK)
+async def process_workflow_job(request: Request, job_id: str, session: SessionContainer = Depends(timed_verify_session)):
+    return await get_process_workflow_job(request, job_id)
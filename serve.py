@@ -0,0 +1,83 @@
+import argparse
+import os
+import subprocess
+import sys
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SERVER_LOOP = os.getenv("SERVER_LOOP", "uvloop")
+SERVER_HTTP = os.getenv("SERVER_HTTP", "httptools")
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+
+# Production entry point: `python serve.py`. Each worker is its own process with
+# its own job workers, chat-session cache and connection pools. The workers
+# share one listening socket and the kernel picks which one accepts a
+# connection, so no balancer in front can pin a chat to a worker; with more
+# than one, chat sessions are written through to Mongo (sync durability) and
+# checked against the stored version before each turn.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the workflow chat API")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--loop", default=SERVER_LOOP, help="uvloop, asyncio or auto")
+    parser.add_argument("--http", default=SERVER_HTTP, help="httptools, h11 or auto")
+    parser.add_argument("--import-time", type=int, nargs="?", const=25, metavar="TOP",
+                        help="print the slowest imports of the app (python -X importtime) and exit")
+    return parser.parse_args()
+
+def import_profile(top: int):
+    # A fresh interpreter, so nothing is already in sys.modules.
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(completed.returncode)
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, module = line.split(":", 1)[1].split("|")
+        rows.append((int(cumulative_us), int(self_us), module.strip()))
+    total = max((cumulative for cumulative, _, module in rows if module == "main"), default=0)
+    print(f"import main: {total / 1000:.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative, self_us, module in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>14.1f} {self_us / 1000:>9.1f}  {module}")
+
+def main():
+    args = parse_args()
+    if args.import_time is not None:
+        import_profile(args.import_time)
+        return
+    if args.workers > 1 and os.getenv("CHAT_SESSION_DURABILITY", "sync").lower() != "sync":
+        sys.stderr.write("CHAT_SESSION_DURABILITY=async needs a single worker; using sync\n")
+    if args.workers > 1:
+        # Read by every worker when it imports the app.
+        os.environ["CHAT_SESSION_DURABILITY"] = "sync"
+        os.environ["CHAT_SESSION_VERIFY_VERSION"] = "true"
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=args.loop,
+        http=args.http,
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEPALIVE,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from fastapi import Request
+from pymongo import ASCENDING
+from controllers.metrics import stage_timer
+
+# "mongo" keeps artifacts in a shared collection every replica can read;
+# "disk" writes them under ARTIFACT_DIR, e.g. for a shared volume.
+ARTIFACT_STORE = os.getenv("ARTIFACT_STORE", "mongo")
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+ARTIFACT_COLLECTION = "workflowartifacts"
+
+CAMPAIGN_INFO = "campaign_launch_requirements"
+FILLED_WORKFLOW = "filled_workflow"
+
+def artifact_id(kind: str, chat_id: str) -> str:
+    return f"{kind}:{chat_id}"
+
+class MongoArtifactStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("chat_id", ASCENDING)])
+
+    async def put(self, kind: str, chat_id: str, data: dict) -> str:
+        key = artifact_id(kind, chat_id)
+        document = {"_id": key, "kind": kind, "chat_id": chat_id, "data": data, "updatedAt": datetime.utcnow()}
+        with stage_timer("artifacts.put"):
+            await self.collection.replace_one({"_id": key}, document, upsert=True)
+        return key
+
+    async def get(self, kind: str, chat_id: str):
+        with stage_timer("artifacts.get"):
+            document = await self.collection.find_one({"_id": artifact_id(kind, chat_id)}, {"data": 1})
+        return document["data"] if document else None
+
+    async def get_many(self, kind: str, chat_ids: list) -> dict:
+        keys = [artifact_id(kind, chat_id) for chat_id in chat_ids]
+        with stage_timer("artifacts.get_many"):
+            documents = await self.collection.find({"_id": {"$in": keys}}, {"chat_id": 1, "data": 1}).to_list(length=len(keys))
+        return {document["chat_id"]: document["data"] for document in documents}
+
+class ShardedDirectoryArtifactStore:
+    """Files fanned out as <root>/<kind>/ab/cd/<sha1>.json so no directory grows unbounded."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    async def ensure_indexes(self):
+        pass
+
+    def path(self, kind: str, chat_id: str) -> str:
+        digest = hashlib.sha1(chat_id.encode()).hexdigest()
+        return os.path.join(self.root, kind, digest[:2], digest[2:4], f"{digest}.json")
+
+    def _write(self, path: str, data: dict):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique temp file per write, so concurrent writes of one artifact
+        # never share a half-written file; the last os.replace wins whole.
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+            try:
+                json.dump(data, file, separators=(",", ":"))
+            except BaseException:
+                file.close()
+                os.unlink(file.name)
+                raise
+        os.replace(file.name, path)
+
+    def _read(self, path: str):
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    async def put(self, kind: str, chat_id: str, data: dict) -> str:
+        with stage_timer("artifacts.put"):
+            await asyncio.to_thread(self._write, self.path(kind, chat_id), data)
+        return artifact_id(kind, chat_id)
+
+    async def get(self, kind: str, chat_id: str):
+        with stage_timer("artifacts.get"):
+            return await asyncio.to_thread(self._read, self.path(kind, chat_id))
+
+    async def get_many(self, kind: str, chat_ids: list) -> dict:
+        with stage_timer("artifacts.get_many"):
+            values = await asyncio.gather(*(asyncio.to_thread(self._read, self.path(kind, chat_id)) for chat_id in chat_ids))
+        return {chat_id: value for chat_id, value in zip(chat_ids, values) if value is not None}
+
+_directory_store = ShardedDirectoryArtifactStore(ARTIFACT_DIR)
+
+def create_artifact_store(database):
+    if ARTIFACT_STORE == "disk":
+        return _directory_store
+    return MongoArtifactStore(database[ARTIFACT_COLLECTION])
+
+def get_artifact_store(request: Request):
+    return create_artifact_store(request.app.database)
@@ -0,0 +1,17 @@
+from controllers.cache import campaign_cache_key
+
+CAMPAIGN_INFO = {
+    "CampaignType": "Product Launch",
+    "AudienceSegment": "Repeat Customers",
+    "ContentType": "Educational",
+    "CallToAction": "Learn More",
+    "SuccessMetrics": "Open Rate",
+}
+
+def test_cache_key_ignores_spelling_of_allowed_values():
+    respelled = {**CAMPAIGN_INFO, "CampaignType": "product launch", "CallToAction": "get more info"}
+    assert campaign_cache_key(respelled) == campaign_cache_key(CAMPAIGN_INFO)
+
+def test_cache_key_covers_every_field_of_the_end_goal_prompt():
+    other_audience = {**CAMPAIGN_INFO, "AudienceSegment": "New Subscribers"}
+    assert campaign_cache_key(other_audience) != campaign_cache_key(CAMPAIGN_INFO)
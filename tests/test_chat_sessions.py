@@ -0,0 +1,124 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import AutoReconnect
+from config.memory_db import InMemoryCollection
+from repositories.chat_sessions import ChatSessionCache
+from repositories.repositories import WorkflowChatRepository
+
+CHAT_ID = "chat-1"
+
+def new_chat():
+    return {"_id": CHAT_ID, "workflowid": "wf-1", "messages": [{"question": "Q0"}], "collected_info": {}, "version": 0}
+
+class CountingCollection(InMemoryCollection):
+    def __init__(self, name):
+        super().__init__(name)
+        self.reads = 0
+
+    async def find_one(self, *args, **kwargs):
+        self.reads += 1
+        return await super().find_one(*args, **kwargs)
+
+class FailingWrites(CountingCollection):
+    failures = 0
+
+    async def update_one(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("primary stepped down")
+        return await super().update_one(*args, **kwargs)
+
+def workers(durability="sync", verify_version=False):
+    # Two workers, each with its own session cache, sharing one collection.
+    collection = CountingCollection("workflowchats")
+    return collection, [
+        ChatSessionCache(WorkflowChatRepository(collection), durability=durability, verify_version=verify_version)
+        for _ in range(2)
+    ]
+
+async def answer(worker, reply, question):
+    chat = await worker.load_turn_state(CHAT_ID, 5)
+    return await worker.append_turn(CHAT_ID, chat.get("version"), reply, {"question": question}, {"CampaignType": reply})
+
+@pytest.mark.parametrize("durability", ["sync", "async"])
+def test_cached_turns_do_not_read_mongo(durability):
+    async def scenario():
+        collection, (a, _) = workers(durability)
+        await a.create(new_chat())
+        for turn in range(5):
+            assert await answer(a, f"reply {turn}", f"Q{turn + 1}")
+        assert collection.reads == 0
+        await a.flush_all()
+        stored = await collection.find_one({"_id": CHAT_ID})
+        assert stored["version"] == 5
+    asyncio.run(scenario())
+
+def test_stale_sync_turn_is_refused_and_the_chat_reloaded():
+    async def scenario():
+        _, (a, b) = workers()
+        await a.create(new_chat())
+        await a.load_turn_state(CHAT_ID, 5)
+        assert await answer(b, "Email", "Q1")
+        assert not await answer(a, "SMS", "Q1")
+        chat = await a.load_turn_state(CHAT_ID, 5)
+        assert chat["collected_info"] == {"CampaignType": "Email"}
+    asyncio.run(scenario())
+
+def test_cached_chat_is_reloaded_after_another_worker_writes():
+    async def scenario():
+        collection, (a, b) = workers(verify_version=True)
+        await a.create(new_chat())
+        assert await answer(b, "Email", "Q1")
+        chat = await a.load_turn_state(CHAT_ID, 5)
+        assert chat["version"] == 1
+        assert [m["question"] for m in chat["messages"]] == ["Q0", "Q1"]
+        assert await answer(a, "SMS", "Q2")
+        stored = await collection.find_one({"_id": CHAT_ID})
+        assert stored["version"] == 2
+        assert [m.get("response") for m in stored["messages"]] == ["Email", "SMS", None]
+    asyncio.run(scenario())
+
+def test_async_turn_lost_to_another_worker_is_reported_not_dropped():
+    async def scenario():
+        _, (a, b) = workers(durability="async")
+        await a.create(new_chat())
+        assert await answer(a, "Email", "Q1")
+        await b.repository.append_turn(CHAT_ID, 0, "SMS", {"question": "Q1"}, {"CampaignType": "SMS"})
+        await a.flush_all()
+        assert a.snapshot()["pending_turns"] == 1
+        with pytest.raises(HTTPException) as raised:
+            await a.load_turn_state(CHAT_ID, 5)
+        assert raised.value.status_code == 409
+        chat = await a.load_turn_state(CHAT_ID, 5)
+        assert chat["collected_info"] == {"CampaignType": "SMS"}
+    asyncio.run(scenario())
+
+def test_async_conflict_is_caught_before_answering_from_cache():
+    async def scenario():
+        _, (a, b) = workers(durability="async", verify_version=True)
+        await a.create(new_chat())
+        assert await answer(a, "Email", "Q1")
+        await b.repository.append_turn(CHAT_ID, 0, "SMS", {"question": "Q1"}, {"CampaignType": "SMS"})
+        with pytest.raises(HTTPException) as raised:
+            await a.load_turn_state(CHAT_ID, 5)
+        assert raised.value.status_code == 409
+        assert a.snapshot()["entries"] == 0
+    asyncio.run(scenario())
+
+def test_failed_sync_write_leaves_the_session_untouched():
+    async def scenario():
+        collection = FailingWrites("workflowchats")
+        cache = ChatSessionCache(WorkflowChatRepository(collection), durability="sync")
+        await cache.create(new_chat())
+        collection.failures = 1
+        with pytest.raises(AutoReconnect):
+            await answer(cache, "Email", "Q1")
+        chat = await cache.load_turn_state(CHAT_ID, 5)
+        assert chat["version"] == 0 and chat["collected_info"] == {}
+        await cache.flush_all()
+        assert (await collection.find_one({"_id": CHAT_ID}))["version"] == 0
+        assert await answer(cache, "SMS", "Q1")
+        stored = await collection.find_one({"_id": CHAT_ID})
+        assert stored["version"] == 1 and stored["collected_info"] == {"CampaignType": "SMS"}
+    asyncio.run(scenario())
@@ -0,0 +1,74 @@
+import asyncio
+from pymongo.errors import AutoReconnect
+from config.memory_db import InMemoryCollection
+from controllers import jobs
+from controllers.jobs import SUCCEEDED, JobQueue
+
+class FlakyCollection(InMemoryCollection):
+    def __init__(self, name, failures):
+        super().__init__(name)
+        self.failures = failures
+
+    async def find_one_and_update(self, *args, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("primary stepped down")
+        return await super().find_one_and_update(*args, **kwargs)
+
+async def handled(job):
+    return {"chat_id": job["chat_id"]}
+
+async def wait_for_status(queue, job_id, status):
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} never reached {status}")
+
+def test_worker_survives_queue_errors(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 0.01)
+    async def scenario():
+        queue = JobQueue(FlakyCollection("workflowjobs", failures=3), handled, workers=1)
+        job = await queue.enqueue("process_workflow", "chat-1")
+        await queue.start()
+        try:
+            done = await wait_for_status(queue, job["_id"], SUCCEEDED)
+        finally:
+            await queue.stop()
+        assert done["result"] == {"chat_id": "chat-1"}
+    asyncio.run(scenario())
+
+def test_batch_includes_jobs_already_pending_for_another_batch():
+    async def scenario():
+        queue = JobQueue(InMemoryCollection("workflowjobs"), handled)
+        first_batch, first_jobs = await queue.enqueue_batch("process_workflow", ["chat-1", "chat-2"])
+        second_batch, second_jobs = await queue.enqueue_batch("process_workflow", ["chat-2", "chat-3"])
+        # The pending job is reused, not queued a second time.
+        assert second_jobs[0]["_id"] == first_jobs[1]["_id"]
+        summary, members = await queue.batch_summary(second_batch)
+        assert sorted(job["chat_id"] for job in members) == ["chat-2", "chat-3"]
+        assert summary["queued"] == 2
+        summary, members = await queue.batch_summary(first_batch)
+        assert sorted(job["chat_id"] for job in members) == ["chat-1", "chat-2"]
+    asyncio.run(scenario())
+
+def test_job_interrupted_by_shutdown_is_queued_again(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 0.01)
+    started = asyncio.Event()
+
+    async def slow(job):
+        started.set()
+        await asyncio.sleep(10)
+
+    async def scenario():
+        queue = JobQueue(InMemoryCollection("workflowjobs"), slow, workers=1)
+        job = await queue.enqueue("process_workflow", "chat-1")
+        await queue.start()
+        await asyncio.wait_for(started.wait(), 1)
+        await queue.stop()
+        stored = await queue.get(job["_id"])
+        assert stored["status"] == "queued"
+        assert stored["lease_expires"] is None
+        assert stored["attempts"] == 0
+    asyncio.run(scenario())
@@ -0,0 +1,96 @@
+import asyncio
+import openai
+import pytest
+from controllers import resilience
+from controllers.resilience import CallPolicy, CircuitOpenError, resilient_call
+
+def open_breaker(call_site, model):
+    policy = resilience.POLICIES[call_site] = CallPolicy(
+        call_site, deadline=1.0, attempt_timeout=1.0, max_retries=0, breaker_failures=1, breaker_reset=0.05)
+    breaker = resilience._breaker(policy, model)
+    breaker.record_failure()
+    assert breaker.is_open
+    return breaker
+
+def test_open_circuit_rejects_calls_until_reset():
+    async def scenario():
+        breaker = open_breaker("test_reject", "m")
+        breaker.reset_seconds = 60
+        with pytest.raises(CircuitOpenError):
+            await resilient_call("test_reject", "m", lambda model: asyncio.sleep(0, "ok"))
+    asyncio.run(scenario())
+
+def test_trial_ending_in_non_retryable_error_releases_the_breaker():
+    async def scenario():
+        breaker = open_breaker("test_invalid", "m")
+        await asyncio.sleep(0.06)
+
+        async def invalid(model):
+            raise openai.error.InvalidRequestError("bad request", None)
+
+        with pytest.raises(openai.error.InvalidRequestError):
+            await resilient_call("test_invalid", "m", invalid)
+        assert await resilient_call("test_invalid", "m", lambda model: asyncio.sleep(0, "ok")) == "ok"
+        assert not breaker.is_open
+    asyncio.run(scenario())
+
+def test_cancelled_trial_releases_the_breaker():
+    async def scenario():
+        breaker = open_breaker("test_cancel", "m")
+        await asyncio.sleep(0.06)
+        task = asyncio.ensure_future(resilient_call("test_cancel", "m", lambda model: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert await resilient_call("test_cancel", "m", lambda model: asyncio.sleep(0, "ok")) == "ok"
+        assert not breaker.is_open
+    asyncio.run(scenario())
+
+def test_stream_trial_ending_in_non_retryable_error_releases_the_breaker():
+    async def scenario():
+        breaker = open_breaker("test_stream", "m")
+        await asyncio.sleep(0.06)
+
+        async def invalid(model):
+            raise openai.error.InvalidRequestError("bad request", None)
+            yield
+
+        with pytest.raises(openai.error.InvalidRequestError):
+            async for _ in resilience.resilient_stream("test_stream", "m", invalid):
+                pass
+        assert breaker.allow()
+    asyncio.run(scenario())
+
+async def chunks(model, count, gap):
+    for index in range(count):
+        await asyncio.sleep(gap)
+        yield f"{model}:{index}"
+
+def test_stream_falls_back_when_the_circuit_is_open():
+    async def scenario():
+        open_breaker("test_stream_fallback", "primary")
+        resilience.POLICIES["test_stream_fallback"].fallback_model = "fallback"
+        resilience.POLICIES["test_stream_fallback"].breaker_reset = 60
+        received = [chunk async for chunk in resilience.resilient_stream(
+            "test_stream_fallback", "primary", lambda model: chunks(model, 2, 0))]
+        assert received == ["fallback:0", "fallback:1"]
+    asyncio.run(scenario())
+
+def test_stream_longer_than_the_deadline_is_not_cut_while_chunks_keep_coming():
+    async def scenario():
+        resilience.POLICIES["test_stream_gaps"] = CallPolicy("test_stream_gaps", deadline=0.3, attempt_timeout=0.2, max_retries=0)
+        received = [chunk async for chunk in resilience.resilient_stream(
+            "test_stream_gaps", "m", lambda model: chunks(model, 8, 0.05))]
+        assert len(received) == 8
+        async def stalls(model):
+            yield "first"
+            await asyncio.sleep(0.25)
+            yield "late"
+
+        received = []
+        with pytest.raises(resilience.DeadlineExceededError):
+            async for chunk in resilience.resilient_stream("test_stream_gaps", "m", stalls):
+                received.append(chunk)
+        assert received == ["first"]
+    asyncio.run(scenario())
@@ -0,0 +1,32 @@
+from controllers.slot_filling import canonical_parameter, fast_fill, validate_update, validate_updates
+
+def test_parameter_names_are_matched_ignoring_case_and_spacing():
+    assert canonical_parameter("campaign type") == "CampaignType"
+    assert canonical_parameter("Audience_Segment") == "AudienceSegment"
+    assert canonical_parameter("A/B Testing Elements") == "A/BTestingElements"
+    assert canonical_parameter("end goal") == "EndGoal"
+    assert canonical_parameter("Budget") is None
+    assert canonical_parameter(None) is None
+
+def test_updates_are_keyed_by_canonical_parameter():
+    updates = validate_updates([
+        {"parameter": "campaign type", "value": "welcome", "valid": True},
+        {"parameter": "emailfrequency", "value": "Weekly", "valid": True},
+        {"parameter": "Budget", "value": "1000", "valid": True},
+    ])
+    assert updates == {"CampaignType": "Welcome Series", "EmailFrequency": "Weekly"}
+
+def test_multi_value_parameters_accept_lists():
+    assert validate_update("A/BTestingElements", "Subject Lines, send times and images") == "Subject Lines, Send Times, Images"
+    assert validate_update("SuccessMetrics", "open rate; ctr; open rate") == "Open Rate, Click-through Rate"
+    # Items that match nothing are dropped, the rest are kept.
+    assert validate_update("SuccessMetrics", "Open Rate, happiness") == "Open Rate"
+    assert validate_update("SuccessMetrics", "happiness, joy") is None
+
+def test_single_value_parameters_reject_lists():
+    assert validate_update("CampaignType", "Newsletter, Product Launch") is None
+
+def test_fast_fill_answers_a_fully_matched_list():
+    result = fast_fill("Which elements would you like to A/B test?", "subject lines and CTAs", {})
+    assert result["updates"] == [{"parameter": "A/BTestingElements", "value": "Subject Lines, CTAs", "valid": True}]
+    assert fast_fill("Which elements would you like to A/B test?", "subject lines and the weather", {}) is None
@@ -0,0 +1,37 @@
+import json
+from controllers.streaming import PartialJSONFields
+
+ARGUMENTS = json.dumps({
+    "updates": [{"parameter": "CampaignType", "value": "Newsletter", "valid": True}],
+    "message": "Great choice \U0001F600 — \"Newsletter\" it is.\nNext up:",
+    "next_question": "Who should receive it? \U0001F4E7",
+    "finished": False,
+})
+
+def stream(arguments, chunk_size):
+    parser = PartialJSONFields(["message", "next_question"])
+    received = {"message": "", "next_question": ""}
+    for offset in range(0, len(arguments), chunk_size):
+        for field, delta in parser.feed(arguments[offset:offset + chunk_size]):
+            received[field] += delta
+    return parser, received
+
+def test_deltas_rebuild_the_fields_for_any_chunking():
+    expected = json.loads(ARGUMENTS)
+    for chunk_size in range(1, 16):
+        parser, received = stream(ARGUMENTS, chunk_size)
+        assert received == {"message": expected["message"], "next_question": expected["next_question"]}
+        assert parser.result() == expected
+
+def test_surrogate_pair_split_across_chunks_is_held_back():
+    parser = PartialJSONFields(["message"])
+    assert parser.feed('{"message": "Hi \\ud83d') == [("message", "Hi ")]
+    assert parser.feed("\\ud") == []
+    assert parser.feed('e00!"') == [("message", "\U0001F600!")]
+
+def test_every_delta_is_encodable():
+    for chunk_size in range(1, 16):
+        parser = PartialJSONFields(["message", "next_question"])
+        for offset in range(0, len(ARGUMENTS), chunk_size):
+            for _, delta in parser.feed(ARGUMENTS[offset:offset + chunk_size]):
+                delta.encode("utf-8")
@@ -0,0 +1,16 @@
+import json
+from controllers.templates import render_workflow
+
+def test_free_text_fields_fill_their_own_placeholders():
+    rendered = json.dumps(render_workflow(
+        {"CampaignType": "Newsletter", "ListName": "VIP readers", "SavedSearch": "https://linkedin.example/search/1"}))
+    assert "VIP readers" in rendered
+    assert "https://linkedin.example/search/1" in rendered
+    assert "saved-search-url" not in rendered
+
+def test_defaults_follow_the_end_goal_override():
+    workflow = render_workflow({"CampaignType": "Newsletter"}, overrides={"endGoal": "Grow the newsletter"})
+    rendered = json.dumps(workflow)
+    assert workflow["endGoal"] == "Grow the newsletter"
+    assert rendered.count("Grow the newsletter") == 3
+    assert "Newsletter-saved-search-url" in rendered